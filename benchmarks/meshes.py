@@ -0,0 +1,77 @@
+'''
+Synthetic meshes for benchmarks, built with the bpy stand-in module.
+'''
+
+import math
+import numpy
+
+import bpy
+
+
+def grid_object(name,
+                triangles,
+                num_materials=8,
+                flat_ratio=0.5,
+                uvs=True,
+                colors=True,
+                seed=0,
+                ):
+    '''
+    Creates a mesh object with a wavy grid of quads, of about the given
+    number of triangles once triangulated.
+
+    Faces are assigned to num_materials materials in blocks of rows, and a
+    random flat_ratio of the faces is flat shaded. The mesh has a planar uv
+    layer and a random vertex color layer.
+    '''
+
+    random = numpy.random.RandomState(seed)
+
+    # grid size in quads
+    columns = max(1, int(math.sqrt(triangles / 2)))
+    rows = max(1, int(round(triangles / 2 / columns)))
+    num_faces = rows * columns
+
+    # vertices
+    x, y = numpy.meshgrid(numpy.linspace(-1, 1, columns + 1),
+                          numpy.linspace(-1, 1, rows + 1))
+    z = 0.1 * numpy.sin(8 * x) * numpy.cos(8 * y)
+    co = numpy.column_stack((x.ravel(), y.ravel(), z.ravel()))
+
+    # quad faces, counter clockwise
+    first = (numpy.arange(rows)[:, None] * (columns + 1) +
+             numpy.arange(columns)).ravel()
+    vertex_index = numpy.column_stack((first,
+                                       first + 1,
+                                       first + columns + 2,
+                                       first + columns + 1)).ravel()
+
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices = bpy._Collection(len(co), co=co.astype(numpy.float32))
+    mesh.loops = bpy._Collection(
+        len(vertex_index),
+        vertex_index=vertex_index.astype(numpy.int32),
+        normal=numpy.zeros((len(vertex_index), 3), numpy.float32))
+    mesh.polygons = bpy._Collection(
+        num_faces,
+        loop_start=numpy.arange(0, 4 * num_faces, 4, dtype=numpy.int32),
+        loop_total=numpy.full(num_faces, 4, dtype=numpy.int32),
+        material_index=(numpy.arange(num_faces) * num_materials //
+                        num_faces).astype(numpy.int32),
+        use_smooth=random.random_sample(num_faces) >= flat_ratio)
+
+    if uvs:
+        uv = co[vertex_index, :2] * 0.5 + 0.5
+        mesh.uv_layers.new("UVMap", bpy._Collection(
+            len(vertex_index), uv=uv.astype(numpy.float32)))
+
+    if colors:
+        vertex_colors = random.random_sample((len(co), 3))
+        mesh.vertex_colors.new("Col", bpy._Collection(
+            len(vertex_index),
+            color=vertex_colors[vertex_index].astype(numpy.float32)))
+
+    for i in range(num_materials):
+        mesh.materials.append(bpy.data.materials.new("%s.%d" % (name, i)))
+
+    return bpy.Object(name, mesh)
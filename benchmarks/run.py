@@ -0,0 +1,258 @@
+'''
+Exporter benchmarks, runnable with a plain Python 3 and numpy, without
+Blender.
+
+The bpy, bmesh and mathutils modules are replaced by the stand-ins in
+benchmarks/standins, and synthetic meshes are exported with:
+
+    map_mesh_object  geometry.map_mesh_object (triangulation, attribute
+                     extraction and split by material)
+    save_geometry    object.save_geometry (weld, encode and write)
+    encode           the json.py encoder, on a built BufferGeometry
+
+usage:
+
+    python benchmarks/run.py [--sizes 10k,100k,1M,10M] [--repeat 3]
+        [--output results.json] [--compare baseline.json]
+
+Results are written as JSON with the exporter version, so runs of
+different versions can be compared with --compare.
+'''
+
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARKS_DIR)
+
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, "standins"))
+sys.path.insert(0, os.path.join(ROOT_DIR, "scripts", "addons"))
+
+import bpy  # noqa: E402
+import io_mesh_three_object  # noqa: E402
+from io_mesh_three_object import build  # noqa: E402
+from io_mesh_three_object import geometry  # noqa: E402
+from io_mesh_three_object import json as three_json  # noqa: E402
+from io_mesh_three_object import object as three_object  # noqa: E402
+from io_mesh_three_object import timing  # noqa: E402
+from io_mesh_three_object import writer  # noqa: E402
+
+import meshes  # noqa: E402
+
+BENCHMARKS = ("map_mesh_object", "save_geometry", "encode")
+
+DEFAULT_SIZES = "10k,100k,1M"
+
+
+def parse_size(text):
+    '''
+    Parses a triangle count, such as 10000, 10k or 10M
+    '''
+    text = text.strip().lower()
+    factor = {"k": 1000, "m": 1000000}.get(text[-1:], 1)
+    if factor > 1:
+        text = text[:-1]
+    return int(float(text) * factor)
+
+
+def measure(func, repeat):
+    '''
+    returns: list of wall times in seconds of repeated func calls
+    '''
+    times = []
+    for i in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def map_mesh_object(mesh_object):
+    global_matrix = three_object.global_rotation_matrix
+    return geometry.map_mesh_object(mesh_object,
+                                    bpy.Scene(),
+                                    global_matrix,
+                                    apply_modifiers=True,
+                                    split_by_material=True,
+                                    )
+
+
+def save_geometry(mesh_map, filepath, processes=1):
+    '''
+    Saves the geometries of a mesh map to filepath, with the globals that
+    object.save sets up.
+    '''
+
+    three_object.global_writer = writer.StreamWriter(filepath)
+    three_object.global_geometry_queue = build.GeometryQueue(
+        three_object.write_geometry, processes=processes)
+    three_object.global_build_options = {}
+
+    object_stats = OrderedDict(timings=timing.Timings(),
+                               vertices=0,
+                               faces=0,
+                               geometries=[])
+
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            for material, attributes in mesh_map.items():
+                three_object.save_geometry(OrderedDict(attributes),
+                                           material.name,
+                                           uuid.uuid4(),
+                                           tag=(object_stats, None),
+                                           )
+            three_object.global_geometry_queue.finish()
+            three_object.global_writer.finish(OrderedDict())
+    finally:
+        three_object.global_writer = None
+        three_object.global_geometry_queue = None
+
+
+def encode(buffergeometry):
+    return "".join(three_json.iterencode(buffergeometry))
+
+
+def run(sizes, benchmarks, repeat, processes):
+    '''
+    returns: OrderedDict of "<benchmark>/<size>" -> result
+    '''
+
+    results = OrderedDict()
+    temp_dir = tempfile.mkdtemp(prefix="three_bench_")
+    filepath = os.path.join(temp_dir, "bench.json")
+
+    def record(name, size, triangles, times):
+        result = OrderedDict()
+        result["triangles"] = triangles
+        result["min"] = min(times)
+        result["median"] = sorted(times)[len(times) // 2]
+        result["times"] = times
+        results["%s/%s" % (name, size)] = result
+        print("%-16s %8s %12d %10.4f %10.4f" %
+              (name, size, triangles, result["min"], result["median"]))
+
+    print("%-16s %8s %12s %10s %10s" %
+          ("Benchmark", "Size", "Triangles", "Min (s)", "Median (s)"))
+
+    try:
+        for size in sizes:
+
+            mesh_object = meshes.grid_object("grid", parse_size(size))
+            triangles = 2 * len(mesh_object.data.polygons)
+
+            mesh_map = map_mesh_object(mesh_object)
+
+            if "map_mesh_object" in benchmarks:
+                record("map_mesh_object", size, triangles,
+                       measure(lambda: map_mesh_object(mesh_object),
+                               repeat))
+
+            if "save_geometry" in benchmarks:
+                record("save_geometry", size, triangles,
+                       measure(lambda: save_geometry(mesh_map,
+                                                     filepath,
+                                                     processes),
+                               repeat))
+
+            if "encode" in benchmarks:
+                attributes = OrderedDict(next(iter(mesh_map.values())))
+                for material_attributes in list(mesh_map.values())[1:]:
+                    for name, array in material_attributes.items():
+                        attributes[name] = numpy.concatenate(
+                            (attributes[name], array))
+                buffergeometry, stats = build.build_geometry(
+                    "grid", uuid.uuid4(), attributes)
+                record("encode", size, triangles,
+                       measure(lambda: encode(buffergeometry), repeat))
+
+            del mesh_object, mesh_map
+            bpy.data.meshes.clear()
+            bpy.data.materials.clear()
+
+    finally:
+        for filename in os.listdir(temp_dir):
+            os.remove(os.path.join(temp_dir, filename))
+        os.rmdir(temp_dir)
+
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=ROOT_DIR,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    '''
+    Prints the ratio of result to baseline minimum times
+    '''
+    print("\n%-28s %10s %10s %8s" %
+          ("Benchmark", "Base (s)", "New (s)", "Ratio"))
+    for name, result in results.items():
+        if name not in baseline["results"]:
+            continue
+        base = baseline["results"][name]["min"]
+        print("%-28s %10.4f %10.4f %7.2fx" %
+              (name, base, result["min"], result["min"] / base))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", default=DEFAULT_SIZES,
+                        help="comma separated triangle counts "
+                             "(default: %s)" % (DEFAULT_SIZES))
+    parser.add_argument("--benchmarks", default=",".join(BENCHMARKS),
+                        help="comma separated benchmark names")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="number of runs of each benchmark")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="save_geometry worker processes")
+    parser.add_argument("--output",
+                        help="write results to a JSON file")
+    parser.add_argument("--compare",
+                        help="compare with a results JSON file")
+    args = parser.parse_args()
+
+    report = OrderedDict()
+    report["version"] = ".".join(
+        str(v) for v in io_mesh_three_object.bl_info["version"])
+    report["revision"] = git_revision()
+    report["date"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    report["python"] = platform.python_version()
+    report["numpy"] = numpy.__version__
+    report["platform"] = platform.platform()
+    report["results"] = run(args.sizes.split(","),
+                            args.benchmarks.split(","),
+                            max(1, args.repeat),
+                            args.processes)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf8", newline="\n") as file:
+            json.dump(report, file, indent=4)
+
+    if args.compare:
+        with open(args.compare, encoding="utf8") as file:
+            compare(report["results"], json.load(file))
+
+
+if __name__ == "__main__":
+    main()
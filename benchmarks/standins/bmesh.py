@@ -0,0 +1,150 @@
+'''
+Stand-in for the Blender bmesh module, for running benchmarks without
+Blender.
+
+A BMesh keeps its data in a bpy stand-in Mesh, and implements the
+vectorized subset of bmesh used by the exporter. Timings of this module
+measure numpy work only, not the Blender C implementation.
+'''
+
+import numpy
+
+import bpy
+
+
+class _Face:
+
+    __slots__ = ("index", "verts")
+
+    def __init__(self, index, num_verts):
+        self.index = index
+        self.verts = range(num_verts)
+
+
+class _Faces:
+
+    def __init__(self, bm):
+        self._bm = bm
+
+    def __len__(self):
+        return len(self._bm._mesh.polygons)
+
+    def __iter__(self):
+        loop_total = self._bm._mesh.polygons.array("loop_total").tolist()
+        return (_Face(i, n) for i, n in enumerate(loop_total))
+
+    def __getitem__(self, index):
+        loop_total = self._bm._mesh.polygons.array("loop_total")
+        return _Face(index, int(loop_total[index]))
+
+    def ensure_lookup_table(self):
+        pass
+
+
+class BMesh:
+
+    def __init__(self):
+        self._mesh = bpy.Mesh("bmesh")
+
+    @property
+    def faces(self):
+        return _Faces(self)
+
+    def from_mesh(self, mesh, face_normals=True):
+        self._mesh = mesh.copy()
+        bpy.data.meshes.remove(self._mesh)
+
+    def from_object(self, object, scene, deform=True, render=False,
+                    cage=False, face_normals=True):
+        self.from_mesh(object.data)
+
+    def to_mesh(self, mesh):
+        source = self._mesh
+        for name in ("vertices", "edges", "loops", "polygons"):
+            setattr(mesh, name, getattr(source, name).copy())
+        for name in ("uv_layers", "vertex_colors"):
+            layers = getattr(mesh, name)
+            del layers[:]
+            for layer in getattr(source, name):
+                layers.new(layer.name, layer.data.copy())
+
+    def transform(self, matrix):
+        m = numpy.asarray(matrix)
+        co = self._mesh.vertices.array("co")
+        co[:] = co.dot(m[:3, :3].T) + m[:3, 3]
+
+    def calc_tessface(self):
+        pass
+
+    def normal_update(self):
+        pass
+
+    def free(self):
+        self._mesh = None
+
+
+def new():
+    return BMesh()
+
+
+def _triangulate(bm, faces, quad_method=0, ngon_method=0):
+    '''
+    Fan triangulates faces with more than three corners
+    '''
+    mesh = bm._mesh
+    polygons = mesh.polygons
+    loop_start = polygons.array("loop_start")
+    loop_total = polygons.array("loop_total")
+
+    selected = numpy.zeros(len(polygons), dtype=bool)
+    if isinstance(faces, _Faces):
+        selected[:] = True
+    else:
+        selected[[f.index for f in faces]] = True
+    selected &= loop_total > 3
+    if not selected.any():
+        return {"faces": []}
+
+    # output faces of each input face
+    face_counts = numpy.where(selected, loop_total - 2, 1)
+    face_polygon = numpy.repeat(numpy.arange(len(polygons)), face_counts)
+    face_offset = numpy.cumsum(face_counts) - face_counts
+    face_triangle = numpy.arange(len(face_polygon)) - \
+        numpy.repeat(face_offset, face_counts)
+    face_selected = selected[face_polygon]
+    face_total = numpy.where(face_selected, 3, loop_total[face_polygon])
+
+    # source loop of each output loop
+    face_start = numpy.cumsum(face_total) - face_total
+    loop_face = numpy.repeat(numpy.arange(len(face_polygon)), face_total)
+    corner = numpy.arange(len(loop_face)) - face_start[loop_face]
+    fan = numpy.where(corner == 0, 0, face_triangle[loop_face] + corner)
+    source_loops = loop_start[face_polygon[loop_face]] + \
+        numpy.where(face_selected[loop_face], fan, corner)
+
+    mesh.loops = bpy._Collection(
+        len(source_loops),
+        **{name: array[source_loops]
+           for name, array in mesh.loops._arrays.items()})
+    for layers in (mesh.uv_layers, mesh.vertex_colors):
+        for layer in layers:
+            layer.data = bpy._Collection(
+                len(source_loops),
+                **{name: array[source_loops]
+                   for name, array in layer.data._arrays.items()})
+    mesh.polygons = bpy._Collection(
+        len(face_polygon),
+        loop_start=face_start.astype(numpy.int32),
+        loop_total=face_total.astype(numpy.int32),
+        material_index=polygons.array("material_index")[face_polygon],
+        use_smooth=polygons.array("use_smooth")[face_polygon])
+
+    return {"faces": []}
+
+
+class _Ops:
+
+    triangulate = staticmethod(_triangulate)
+
+
+ops = _Ops()
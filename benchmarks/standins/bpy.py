@@ -0,0 +1,286 @@
+'''
+Stand-in for the Blender bpy module, for running benchmarks without
+Blender.
+
+Meshes keep their data in numpy arrays, and implement the bulk
+foreach_get / foreach_set access and split normals used by the exporter.
+Objects have no modifiers, so Object.to_mesh returns a copy of the mesh.
+'''
+
+import sys as _sys
+import types as _types
+import numpy
+
+from mathutils import Matrix
+
+
+class _Collection:
+    '''
+    A bpy_prop_collection of items with numpy array properties
+    '''
+
+    def __init__(self, length=0, **arrays):
+        self._length = length
+        self._arrays = arrays
+
+    def __len__(self):
+        return self._length
+
+    def foreach_get(self, name, buffer):
+        buffer[:] = self._arrays[name].ravel()
+
+    def foreach_set(self, name, buffer):
+        array = self._arrays[name]
+        array.ravel()[:] = buffer
+
+    def add(self, count):
+        for name, array in self._arrays.items():
+            shape = (self._length + count,) + array.shape[1:]
+            self._arrays[name] = numpy.resize(array, shape)
+        self._length += count
+
+    def array(self, name):
+        return self._arrays[name]
+
+    def copy(self):
+        return _Collection(self._length,
+                           **{name: array.copy()
+                              for name, array in self._arrays.items()})
+
+
+class _Layer:
+
+    def __init__(self, name, data):
+        self.name = name
+        self.data = data
+
+
+class _Layers(list):
+    '''
+    uv_layers or vertex_colors of a mesh. The first layer is active.
+    '''
+
+    @property
+    def active(self):
+        return self[0] if self else None
+
+    def new(self, name="", data=None):
+        layer = _Layer(name, data)
+        self.append(layer)
+        return layer
+
+
+class ID:
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return "<%s %r>" % (type(self).__name__, self.name)
+
+
+class Material(ID):
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.diffuse_color = (0.8, 0.8, 0.8)
+        self.diffuse_intensity = 0.8
+        self.specular_color = (1.0, 1.0, 1.0)
+        self.specular_intensity = 0.5
+        self.specular_hardness = 50
+        self.emit = 0.0
+        self.alpha = 1.0
+        self.use_transparency = False
+        self.use_vertex_color_paint = False
+        self.use_shadeless = False
+
+
+class Mesh(ID):
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.vertices = _Collection(0, co=numpy.empty((0, 3), "f4"))
+        self.edges = _Collection(0, vertices=numpy.empty((0, 2), "i4"))
+        self.loops = _Collection(0,
+                                 vertex_index=numpy.empty(0, "i4"),
+                                 normal=numpy.empty((0, 3), "f4"))
+        self.polygons = _Collection(0,
+                                    loop_start=numpy.empty(0, "i4"),
+                                    loop_total=numpy.empty(0, "i4"),
+                                    material_index=numpy.empty(0, "i4"),
+                                    use_smooth=numpy.empty(0, bool))
+        self.uv_layers = _Layers()
+        self.vertex_colors = _Layers()
+        self.materials = []
+        self.use_auto_smooth = False
+        self.auto_smooth_angle = 0.523599
+        self.has_custom_normals = False
+        self.shape_keys = None
+        self.users = 1
+
+    def copy(self):
+        mesh = data.meshes.new(self.name)
+        for name in ("vertices", "edges", "loops", "polygons"):
+            setattr(mesh, name, getattr(self, name).copy())
+        for name in ("uv_layers", "vertex_colors"):
+            for layer in getattr(self, name):
+                getattr(mesh, name).new(layer.name, layer.data.copy())
+        mesh.materials = list(self.materials)
+        mesh.use_auto_smooth = self.use_auto_smooth
+        mesh.auto_smooth_angle = self.auto_smooth_angle
+        return mesh
+
+    def _face_normals(self):
+        '''
+        returns: unnormalized face normals of the first three face corners
+        '''
+        co = self.vertices.array("co")
+        vertex_index = self.loops.array("vertex_index")
+        loop_start = self.polygons.array("loop_start")
+        a, b, c = (co[vertex_index[loop_start + i]] for i in range(3))
+        return numpy.cross(b - a, c - a)
+
+    def calc_normals_split(self):
+        '''
+        Face normals for flat faces, and area weighted vertex normals for
+        smooth faces. Auto smooth and custom normals are not supported.
+        '''
+        vertex_index = self.loops.array("vertex_index")
+        loop_total = self.polygons.array("loop_total")
+        face_normals = self._face_normals()
+        loop_faces = numpy.repeat(numpy.arange(len(loop_total)), loop_total)
+
+        vertex_normals = numpy.empty((len(self.vertices), 3))
+        for axis in range(3):
+            vertex_normals[:, axis] = numpy.bincount(
+                vertex_index,
+                weights=face_normals[loop_faces, axis],
+                minlength=len(self.vertices))
+
+        def normalize(v):
+            length = numpy.sqrt((v * v).sum(axis=1))[:, None]
+            return v / numpy.where(length > 0, length, 1)
+
+        smooth = self.polygons.array("use_smooth")[loop_faces]
+        normals = numpy.where(smooth[:, None],
+                              normalize(vertex_normals)[vertex_index],
+                              normalize(face_normals)[loop_faces])
+        self.loops._arrays["normal"] = normals.astype(numpy.float32)
+
+    def free_normals_split(self):
+        pass
+
+    def calc_tessface(self):
+        pass
+
+
+class Object(ID):
+
+    def __init__(self, name, object_data):
+        super().__init__(name)
+        self.data = object_data
+        self.type = "MESH"
+        self.modifiers = []
+        self.matrix_world = Matrix.Identity(4)
+        self.matrix_local = Matrix.Identity(4)
+        self.animation_data = None
+        self.select = True
+
+    def to_mesh(self, scene, apply_modifiers, settings,
+                calc_tessface=True, calc_undeformed=False):
+        return self.data.copy()
+
+
+class Scene(ID):
+
+    def __init__(self, name="Scene"):
+        super().__init__(name)
+        self.frame_current = 1
+        self.objects = []
+
+
+class _BlendDataCollection(dict):
+
+    def __init__(self, type):
+        super().__init__()
+        self._type = type
+
+    def new(self, name):
+        item = self._type(name)
+        key = name
+        number = 0
+        while key in self:
+            number += 1
+            key = "%s.%03d" % (name, number)
+        item.name = key
+        self[key] = item
+        return item
+
+    def remove(self, item):
+        del self[item.name]
+
+    def __iter__(self):
+        return iter(self.values())
+
+
+data = _types.SimpleNamespace(
+    filepath="",
+    meshes=_BlendDataCollection(Mesh),
+    materials=_BlendDataCollection(Material),
+    objects=_BlendDataCollection(ID),
+)
+
+
+# registration and operator stand-ins, used by the add-on __init__ module
+
+class Operator:
+
+    def as_keywords(self, ignore=()):
+        return {}
+
+
+class _Menu:
+
+    @staticmethod
+    def append(func):
+        pass
+
+    @staticmethod
+    def remove(func):
+        pass
+
+
+types = _types.SimpleNamespace(
+    ID=ID,
+    Mesh=Mesh,
+    Material=Material,
+    Object=Object,
+    Scene=Scene,
+    Operator=Operator,
+    INFO_MT_file_export=_Menu,
+)
+
+
+def _property(*args, **kwargs):
+    return (_property, kwargs)
+
+
+props = _types.SimpleNamespace(
+    StringProperty=_property,
+    BoolProperty=_property,
+    FloatProperty=_property,
+    IntProperty=_property,
+    EnumProperty=_property,
+)
+
+
+utils = _types.SimpleNamespace(
+    register_module=lambda name: None,
+    unregister_module=lambda name: None,
+)
+
+app = _types.SimpleNamespace(version=(2, 74, 0), binary_path="")
+
+# allow "from bpy.props import ..." and "from bpy.types import ..."
+_sys.modules[__name__ + ".props"] = props
+_sys.modules[__name__ + ".types"] = types
@@ -0,0 +1,83 @@
+'''
+Stand-in for the Blender mathutils module, for running benchmarks without
+Blender. Only the Matrix features used by the exporter are implemented.
+'''
+
+import math
+import numpy
+
+
+class _Row(tuple):
+
+    def to_tuple(self):
+        return tuple(self)
+
+
+class Matrix:
+
+    def __init__(self, rows=None):
+        if rows is None:
+            rows = numpy.identity(4)
+        self._m = numpy.array(rows, dtype=numpy.float64)
+
+    @classmethod
+    def Identity(cls, size):
+        return cls(numpy.identity(size))
+
+    @classmethod
+    def Scale(cls, factor, size, axis=None):
+        m = numpy.identity(size)
+        for i in range(min(size, 3)):
+            m[i, i] = factor
+        return cls(m)
+
+    @classmethod
+    def Translation(cls, vector):
+        m = numpy.identity(4)
+        m[:3, 3] = vector
+        return cls(m)
+
+    @classmethod
+    def Rotation(cls, angle, size, axis):
+        c, s = math.cos(angle), math.sin(angle)
+        i, j = {"X": (1, 2), "Y": (2, 0), "Z": (0, 1)}[axis]
+        m = numpy.identity(size)
+        m[i, i] = c
+        m[i, j] = -s
+        m[j, i] = s
+        m[j, j] = c
+        return cls(m)
+
+    def __mul__(self, other):
+        return Matrix(self._m.dot(other._m))
+
+    def __array__(self, dtype=None, copy=None):
+        return self._m.astype(dtype) if dtype else self._m
+
+    def __iter__(self):
+        return (_Row(row) for row in self._m.tolist())
+
+    def __len__(self):
+        return len(self._m)
+
+    def __getitem__(self, index):
+        return _Row(self._m[index].tolist())
+
+    def __eq__(self, other):
+        return isinstance(other, Matrix) and \
+            numpy.array_equal(self._m, other._m)
+
+    def copy(self):
+        return Matrix(self._m)
+
+    def determinant(self):
+        return float(numpy.linalg.det(self._m))
+
+    def inverted(self):
+        return Matrix(numpy.linalg.inv(self._m))
+
+
+class Vector(tuple):
+
+    def to_tuple(self):
+        return tuple(self)
@@ -4,7 +4,7 @@ bl_info = {
     "name": "Export Three.js Object Format 4.3 (.json)",
     "author": "satori99",
     "version": (0, 0, 1),
-    "blender": (2, 72, 0),
+    "blender": (2, 74, 0),
     "location": "File > Export > Three.js Object (.json)",
     "description":
         "Exports Three.js Object Format 4.3 JSON files",
@@ -19,12 +19,36 @@ bl_info = {
 # reload local modules
 if "bpy" in locals():
     import imp
+    if "batch" in locals():
+        imp.reload(batch)
+    if "bounds" in locals():
+        imp.reload(bounds)
+    if "bvh" in locals():
+        imp.reload(bvh)
+    if "binary" in locals():
+        imp.reload(binary)
     if "geometry" in locals():
         imp.reload(geometry)
+    if "timing" in locals():
+        imp.reload(timing)
+    if "index" in locals():
+        imp.reload(index)
+    if "quantize" in locals():
+        imp.reload(quantize)
     if "json" in locals():
         imp.reload(json)
+    if "lod" in locals():
+        imp.reload(lod)
+    if "morph" in locals():
+        imp.reload(morph)
     if "three" in locals():
         imp.reload(three)
+    if "writer" in locals():
+        imp.reload(writer)
+    if "cache" in locals():
+        imp.reload(cache)
+    if "build" in locals():
+        imp.reload(build)
     if "object" in locals():
         imp.reload(object)
 
@@ -82,6 +106,13 @@ class ExportThreeObject(bpy.types.Operator):
         default=True
         )
 
+    merge_materials = BoolProperty(
+        name="Merge Materials",
+        description="Export materials with identical properties as a "
+                    "single Three.js material",
+        default=False
+        )
+
     export_normals = BoolProperty(
         name="Export Normals",
         description="Export BufferGeometry normal attribute",
@@ -106,6 +137,85 @@ class ExportThreeObject(bpy.types.Operator):
         default=True
         )
 
+    lod_levels = IntProperty(
+        name="LOD Levels",
+        description="Number of decimated levels of detail exported with "
+                    "each mesh as a THREE.LOD (0 = no levels of detail). "
+                    "Disables static batching",
+        default=0,
+        min=0,
+        max=8,
+        )
+
+    lod_ratio = FloatProperty(
+        name="LOD Ratio",
+        description="Ratio of triangles kept by each level of detail, "
+                    "relative to the previous level",
+        default=0.5,
+        min=0.01,
+        max=0.99,
+        )
+
+    lod_distance = FloatProperty(
+        name="LOD Distance",
+        description="Camera distance between levels of detail",
+        default=10.0,
+        min=0.0,
+        max=100000.0,
+        )
+
+    static_batching = BoolProperty(
+        name="Static Batching",
+        description="Merge static (not animated) meshes that share a "
+                    "material into batched geometries, in world space. "
+                    "Ignored when LOD Levels is set",
+        default=False
+        )
+
+    batch_max_vertices = IntProperty(
+        name="Batch Max Vertices",
+        description="Maximum vertices of a batched geometry (65535 allows "
+                    "Uint16 indices). Loops are counted, as a cheap upper "
+                    "bound of the vertices",
+        default=65535,
+        min=1024,
+        max=16777216,
+        )
+
+    batch_cell_size = FloatProperty(
+        name="Batch Cell Size",
+        description="Size of the grid cells that batches are grouped by, "
+                    "so they can be frustum culled (0 = no grouping)",
+        default=0.0,
+        min=0.0,
+        max=100000.0,
+        )
+
+    instancing = BoolProperty(
+        name="Instancing",
+        description="Export static meshes that share mesh data as "
+                    "THREE.InstancedMesh objects",
+        default=False
+        )
+
+    instance_min_count = IntProperty(
+        name="Min Instances",
+        description="Minimum number of objects sharing mesh data that are "
+                    "exported as an instanced mesh",
+        default=2,
+        min=2,
+        max=1000000,
+        )
+
+    instance_max_count = IntProperty(
+        name="Max Instances",
+        description="Maximum number of instances of an instanced mesh. "
+                    "Larger groups are split",
+        default=1024,
+        min=1,
+        max=1000000,
+        )
+
     morph_animation = BoolProperty(
         name="Export morph animations",
         description="Export MorphTarget animations",
@@ -114,7 +224,7 @@ class ExportThreeObject(bpy.types.Operator):
 
     sample_rate = FloatProperty(
         name="Sample Rate",
-        description="Morph animation sample rate",
+        description="Morph animation sample rate, in frames",
         default=1.0,
         min=1,
         max=10,
@@ -134,6 +244,85 @@ class ExportThreeObject(bpy.types.Operator):
         max=10,
         )
 
+    binary_attributes = BoolProperty(
+        name="Binary Attributes",
+        description="Write BufferGeometry attribute arrays to a binary "
+                    "(.bin) file next to the JSON file",
+        default=False
+        )
+
+    quantize_attributes = BoolProperty(
+        name="Quantize Attributes",
+        description="Store indices, normals, uvs and colors as narrower "
+                    "integer types when accurate enough",
+        default=False
+        )
+
+    quantize_positions = BoolProperty(
+        name="Quantize Positions",
+        description="Store positions as normalized Uint16 values with a "
+                    "dequantization offset and scale",
+        default=False
+        )
+
+    quantize_tolerance = FloatProperty(
+        name="Quantize Tolerance",
+        description="Maximum quantization error. Attributes that exceed it "
+                    "are exported as floats",
+        default=0.005,
+        min=0.00001,
+        max=1.0,
+        precision=5,
+        )
+
+    processes = IntProperty(
+        name="Worker Processes",
+        description="Number of processes used to build and encode "
+                    "geometries (0 = one per CPU core, 1 = no workers)",
+        default=1,
+        min=0,
+        max=256,
+        )
+
+    export_cache = BoolProperty(
+        name="Incremental Export",
+        description="Keep built geometries in a cache folder next to the "
+                    "exported file, and reuse them for unchanged meshes",
+        default=False
+        )
+
+    optimize_vertex_cache = BoolProperty(
+        name="Optimize Vertex Cache",
+        description="Reorder indexed triangles and vertices for the GPU "
+                    "vertex cache",
+        default=False
+        )
+
+    build_bvh = BoolProperty(
+        name="Build BVH",
+        description="Build a bounding volume hierarchy for raycasting over "
+                    "each geometry, and write it to a BVH (.bvh) file next "
+                    "to the exported file. Triangles are ordered by BVH "
+                    "leaf, so vertex cache optimization only reorders "
+                    "vertices",
+        default=False
+        )
+
+    deterministic = BoolProperty(
+        name="Deterministic Output",
+        description="Derive uuids from object names and geometry and "
+                    "material content, so unchanged scenes export "
+                    "identical files",
+        default=False
+        )
+
+    export_stats = BoolProperty(
+        name="Export Statistics",
+        description="Write per-object and per-phase export timings to a "
+                    "stats (.stats.json) file next to the exported file",
+        default=False
+        )
+
     # Operator methods
 
     def invoke(self, context, event):
@@ -164,6 +353,8 @@ class ExportThreeObject(bpy.types.Operator):
         row.prop(self.properties, "apply_modifiers")
         row = layout.row()
         row.prop(self.properties, "split_by_material")
+        row = layout.row()
+        row.prop(self.properties, "merge_materials")
 
         layout.separator()
         row = layout.row()
@@ -174,6 +365,34 @@ class ExportThreeObject(bpy.types.Operator):
         row.prop(self.properties, "export_colors")
         row = layout.row()
         row.prop(self.properties, "export_index")
+        row = layout.row()
+        row.prop(self.properties, "optimize_vertex_cache")
+        row = layout.row()
+        row.prop(self.properties, "build_bvh")
+
+        layout.separator()
+        row = layout.row()
+        row.prop(self.properties, "lod_levels")
+        row = layout.row()
+        row.prop(self.properties, "lod_ratio")
+        row = layout.row()
+        row.prop(self.properties, "lod_distance")
+
+        layout.separator()
+        row = layout.row()
+        row.prop(self.properties, "static_batching")
+        row = layout.row()
+        row.prop(self.properties, "batch_max_vertices")
+        row = layout.row()
+        row.prop(self.properties, "batch_cell_size")
+
+        layout.separator()
+        row = layout.row()
+        row.prop(self.properties, "instancing")
+        row = layout.row()
+        row.prop(self.properties, "instance_min_count")
+        row = layout.row()
+        row.prop(self.properties, "instance_max_count")
 
         layout.separator()
         row = layout.row()
@@ -187,6 +406,22 @@ class ExportThreeObject(bpy.types.Operator):
         row.prop(self.properties, "morph_animation_in_userdata")
         row = layout.row()
         row.prop(self.properties, "float_precision")
+        row = layout.row()
+        row.prop(self.properties, "binary_attributes")
+        row = layout.row()
+        row.prop(self.properties, "quantize_attributes")
+        row = layout.row()
+        row.prop(self.properties, "quantize_positions")
+        row = layout.row()
+        row.prop(self.properties, "quantize_tolerance")
+        row = layout.row()
+        row.prop(self.properties, "processes")
+        row = layout.row()
+        row.prop(self.properties, "export_cache")
+        row = layout.row()
+        row.prop(self.properties, "export_stats")
+        row = layout.row()
+        row.prop(self.properties, "deterministic")
 
     def execute(self, context):
         print("\nExporting Three.js Object '%s' ...\n" % (self.filepath))
@@ -0,0 +1,109 @@
+import numpy
+from collections import OrderedDict
+
+# This module does not use bpy. Materials are only used as dict keys.
+
+# default maximum vertices of a batch, so batches can use Uint16 indices
+BATCH_MAX_VERTICES = 65535
+
+
+class Batch:
+    '''
+    Per-loop vertex attribute arrays of mesh objects that are concatenated
+    into a single geometry
+    '''
+
+    def __init__(self, material, cell):
+        self.material = material
+        self.cell = cell
+        self.parts = []
+        self.num_loops = 0
+
+    def add(self, attributes):
+        self.parts.append(attributes)
+        self.num_loops += len(attributes["position"])
+
+    def attributes(self):
+        '''
+        returns: OrderedDict of concatenated per-loop attribute arrays
+        '''
+        return OrderedDict(
+            (name, numpy.concatenate([part[name] for part in self.parts]))
+            for name in self.parts[0])
+
+
+class StaticBatcher:
+    '''
+    Groups the per-material vertex attribute arrays of static mesh objects
+    into batches that are drawn with a single draw call.
+
+    Attributes must already be transformed to world space. Parts with the
+    same material and attribute layout are added to the same batch, until
+    it would exceed max_vertices. A part that exceeds max_vertices on its
+    own gets a batch of its own.
+
+    Batches are capped on their number of loops, which is an upper bound
+    of their number of exported vertices. Counting the vertices would
+    need an extra weld of every part on the calling thread, while the
+    batch geometry is welded by build_geometry anyway, possibly in a
+    worker process.
+
+    When cell_size is set, parts are also grouped by the grid cell of their
+    bounding box center, so batches stay spatially compact and can still
+    be frustum culled.
+
+    Full batches are passed to callback(material, attributes) as soon as
+    they are closed, so batched data is not all held in memory at once.
+    '''
+
+    def __init__(self,
+                 callback,
+                 max_vertices=BATCH_MAX_VERTICES,
+                 cell_size=0.0,
+                 ):
+        self.callback = callback
+        self.max_vertices = max_vertices
+        self.cell_size = cell_size
+        self.batches = OrderedDict()
+
+    def cell(self, positions):
+        '''
+        returns: grid cell of the bounding box center of positions
+        '''
+        if not self.cell_size or not len(positions):
+            return None
+        center = (positions.min(axis=0) + positions.max(axis=0)) / 2
+        return tuple(numpy.floor(center / self.cell_size).astype(int).tolist())
+
+    def add(self, material, attributes):
+        '''
+        Adds the per-loop attribute arrays of a mesh object material
+        '''
+        if not len(attributes["position"]):
+            return
+
+        num_loops = len(attributes["position"])
+        key = (material,
+               self.cell(attributes["position"]),
+               tuple(attributes))
+
+        batch = self.batches.get(key)
+        if batch is not None and \
+                batch.num_loops + num_loops > self.max_vertices:
+            self.close(key)
+            batch = None
+        if batch is None:
+            batch = self.batches[key] = Batch(material, key[1])
+
+        batch.add(attributes)
+
+    def close(self, key):
+        batch = self.batches.pop(key)
+        self.callback(batch.material, batch.attributes())
+
+    def finish(self):
+        '''
+        Closes all open batches
+        '''
+        for key in list(self.batches):
+            self.close(key)
@@ -0,0 +1,123 @@
+import os
+import hashlib
+import numpy
+
+
+# typed array type -> little endian numpy dtype
+TYPED_ARRAY_DTYPES = {
+    "Int8Array": numpy.dtype("<i1"),
+    "Uint8Array": numpy.dtype("<u1"),
+    "Int16Array": numpy.dtype("<i2"),
+    "Uint16Array": numpy.dtype("<u2"),
+    "Int32Array": numpy.dtype("<i4"),
+    "Uint32Array": numpy.dtype("<u4"),
+    "Float32Array": numpy.dtype("<f4"),
+}
+
+# byte alignment of each array in the binary file. Every typed array
+# type can be created directly over a 4 byte aligned ArrayBuffer offset.
+BYTE_ALIGNMENT = 4
+
+
+def sidecar_filepath(filepath, extension=".bin"):
+    '''
+    Returns the filepath of a sidecar file for the specified JSON filepath
+    '''
+    return os.path.splitext(filepath)[0] + extension
+
+
+class BinaryWriter:
+    '''
+    Writes typed array data sequentially to a binary sidecar file.
+
+    Arrays are written as raw little endian data, so a client can create
+    typed arrays directly over the fetched ArrayBuffer:
+
+        new Float32Array(buffer, attribute.byteOffset,
+                         attribute.byteLength / 4)
+
+    Arrays with identical content, such as the attributes of levels of
+    detail that were not simplified, are only written once and share
+    their byteOffset.
+
+    Like writer.StreamWriter, the file is written to a temporary file that
+    only replaces filepath in finish().
+    '''
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.temp_filepath = filepath + ".tmp"
+        self.uri = os.path.basename(filepath)
+        self.byte_length = 0
+        self.blobs = {}
+        self.file = open(self.temp_filepath, "wb")
+
+    def write(self, array, type):
+        '''
+        Writes an array as the specified typed array type.
+
+        returns: tuple (byteOffset, byteLength)
+        '''
+        data = numpy.ascontiguousarray(array, dtype=TYPED_ARRAY_DTYPES[type])
+        data_bytes = memoryview(data).cast("B")
+
+        # reuse identical arrays
+        key = (data.nbytes, hashlib.sha1(data_bytes).digest())
+        if key in self.blobs:
+            return self.blobs[key]
+
+        byte_offset = self.byte_length
+        byte_length = data.nbytes
+        self.file.write(data_bytes)
+        self.blobs[key] = (byte_offset, byte_length)
+
+        # pad to the next aligned offset
+        padding = -byte_length % BYTE_ALIGNMENT
+        if padding:
+            self.file.write(bytes(padding))
+
+        self.byte_length += byte_length + padding
+
+        return byte_offset, byte_length
+
+    def finish(self):
+        '''
+        Closes the file, and moves it to filepath
+        '''
+        self.file.close()
+        os.replace(self.temp_filepath, self.filepath)
+
+    def close(self):
+        '''
+        Closes and deletes an unfinished file. Does nothing after finish().
+        '''
+        self.file.close()
+        if os.path.exists(self.temp_filepath):
+            os.remove(self.temp_filepath)
+
+
+def _typed_arrays(geometry):
+    '''
+    Yields the attribute and morph target OrderedDicts of a BufferGeometry
+    '''
+    data = geometry["data"]
+    for attribute in data["attributes"].values():
+        yield attribute
+    for targets in data.get("morphAttributes", {}).values():
+        for target in targets:
+            yield target
+    for target in geometry.get("userData", {}).get("morphTargets", []):
+        yield target
+
+
+def store_attributes(writer, geometry):
+    '''
+    Moves the attribute and morph target arrays of a BufferGeometry
+    OrderedDict to a binary file, and replaces them with byteOffset and
+    byteLength values.
+    '''
+    for attribute in _typed_arrays(geometry):
+        byte_offset, byte_length = writer.write(attribute.pop("array"),
+                                                attribute["type"])
+        attribute["byteOffset"] = byte_offset
+        attribute["byteLength"] = byte_length
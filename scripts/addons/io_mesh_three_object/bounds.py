@@ -0,0 +1,101 @@
+import numpy
+from collections import OrderedDict
+
+# This module must not use bpy, since bounding volumes are computed in
+# worker processes.
+
+# maximum number of bounding sphere growth passes
+RITTER_MAX_PASSES = 16
+
+
+def bounding_box(positions):
+    '''
+    Computes the axis aligned bounding box of an (n, 3) positions array.
+
+    returns: tuple (min, max) of float64 arrays
+    '''
+    return positions.min(axis=0), positions.max(axis=0)
+
+
+def bounding_sphere(positions, box=None):
+    '''
+    Computes a tight bounding sphere of an (n, 3) positions array.
+
+    Ritter's algorithm starts with the sphere through the two farthest
+    apart extreme points, then grows it to the farthest outside point
+    until no point is outside. Each step is one vectorized pass over the
+    positions. After RITTER_MAX_PASSES steps, the radius is extended to the
+    farthest point instead.
+
+    The sphere around the bounding box center is used instead when it is
+    smaller.
+
+    returns: tuple (center, radius)
+    '''
+    positions = numpy.asarray(positions, dtype=numpy.float64)
+
+    # work relative to the bounding box center, for precision
+    if box is None:
+        box = bounding_box(positions)
+    origin = (box[0] + box[1]) / 2
+    positions = positions - origin
+
+    # squared distances are |p|^2 - 2 p.c + |c|^2, so each pass is a
+    # single matrix-vector product
+    squared_norms = numpy.einsum("ij,ij->i", positions, positions)
+
+    def farthest(point):
+        d = squared_norms - 2 * positions.dot(point)
+        i = int(d.argmax())
+        return positions[i], max(d[i] + point.dot(point), 0.0)
+
+    # initial sphere from a pair of far apart points
+    a = farthest(positions[0])[0]
+    b = farthest(a)[0]
+    center = (a + b) / 2
+    radius = numpy.sqrt(((b - a) ** 2).sum()) / 2
+
+    # grow to include the farthest point, until every point is inside
+    for i in range(RITTER_MAX_PASSES):
+        point, d2 = farthest(center)
+        d = numpy.sqrt(d2)
+        if d <= radius:
+            break
+        new_radius = (radius + d) / 2
+        center = center + (point - center) * ((new_radius - radius) / d)
+        radius = new_radius
+    else:
+        radius = max(radius, numpy.sqrt(farthest(center)[1]))
+
+    # sphere around the bounding box center
+    box_radius = numpy.sqrt(farthest(numpy.zeros(3))[1])
+    if box_radius < radius:
+        center, radius = numpy.zeros(3), box_radius
+
+    return center + origin, radius
+
+
+def add_bounding_volumes(geometry, positions):
+    '''
+    Adds the boundingBox and boundingSphere of (n, 3) positions to the data
+    of a BufferGeometry OrderedDict, so clients do not have to compute
+    them from the position attribute.
+
+    Bounds are in the units of the unquantized positions.
+    '''
+    if not len(positions):
+        return
+
+    positions = numpy.asarray(positions, dtype=numpy.float64)
+    box = bounding_box(positions)
+    center, radius = bounding_sphere(positions, box)
+
+    data = geometry["data"]
+
+    bounding_box_data = data["boundingBox"] = OrderedDict()
+    bounding_box_data["min"] = box[0].tolist()
+    bounding_box_data["max"] = box[1].tolist()
+
+    bounding_sphere_data = data["boundingSphere"] = OrderedDict()
+    bounding_sphere_data["center"] = center.tolist()
+    bounding_sphere_data["radius"] = float(radius)
@@ -0,0 +1,300 @@
+import os
+import sys
+import multiprocessing
+import numpy
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from . import bounds
+from . import bvh
+from . import index
+from . import quantize
+from . import three
+from . import timing
+from . import writer
+
+# This module must not use bpy, since build_geometry and process_geometry
+# run in worker processes.
+
+
+def build_geometry(geometry_name,
+                   geometry_uuid,
+                   attributes,
+                   export_index=True,
+                   quantize_options=None,
+                   optimize_vertex_cache=False,
+                   morph_targets=None,
+                   morph_in_userdata=True,
+                   build_bvh=False,
+                   ):
+    '''
+    Builds a BufferGeometry OrderedDict from per-loop vertex attribute
+    arrays, as returned by geometry.extract_attributes.
+
+    Morph targets (as returned by morph.sample_morph_targets) need the
+    "vertex" attribute array, which maps loops to morph target vertices.
+
+    returns: tuple (geometry, stats)
+
+    stats is an OrderedDict with the geometry name, phase timings, vertex,
+    normal and face counts, and the vertex cache statistics when
+    optimize_vertex_cache is used.
+
+    When build_bvh is set, triangles are reordered to match the leaves of
+    a BVH, which is added to the geometry userData. optimize_vertex_cache
+    then only reorders vertices, and the cache statistics describe the
+    BVH triangle order.
+    '''
+
+    stats = OrderedDict()
+    stats["name"] = geometry_name
+    timings = stats["timings"] = timing.Timings()
+
+    indices = None
+
+    if export_index:
+        with timings.phase("index"):
+
+            # Indexed BufferGeometry
+
+            # find unique vertices. loops with identical attribute data
+            # share a single vertex
+            unique_loops, indices = index.weld(list(attributes.values()))
+
+            # keep the vertex attribute data of unique loops only
+            for name, array in attributes.items():
+                attributes[name] = array[unique_loops]
+
+            if optimize_vertex_cache:
+
+                # reorder triangles for the vertex cache. The BVH replaces
+                # the triangle order with its leaf order, so Tipsify is
+                # skipped when a BVH is built.
+                num_vertices = len(unique_loops)
+                stats["acmr"], stats["atvr"] = index.cache_stats(indices,
+                                                                 num_vertices)
+                if not build_bvh:
+                    indices = index.tipsify(indices, num_vertices)
+
+    if build_bvh:
+        with timings.phase("bvh"):
+
+            # build BVH over the triangles, and reorder the triangles to
+            # match the leaves
+            positions = attributes["position"]
+            if indices is not None:
+                triangles = indices.reshape(-1, 3)
+                nodes, order = bvh.build_bvh(positions, triangles)
+                indices = triangles[order].ravel()
+            else:
+                triangles = numpy.arange(len(positions)).reshape(-1, 3)
+                nodes, order = bvh.build_bvh(positions, triangles)
+                loops = triangles[order].ravel()
+                for name, array in attributes.items():
+                    attributes[name] = array[loops]
+            stats["bvh_nodes"] = len(nodes)
+
+    if indices is not None and optimize_vertex_cache:
+        with timings.phase("index"):
+
+            # reorder vertices by first use in the final triangle order,
+            # for vertex fetch locality. Triangle order, and so the BVH,
+            # is unchanged.
+            vertices, indices = index.reorder_vertices(indices)
+            for name, array in attributes.items():
+                attributes[name] = array[vertices]
+            stats["optimized_acmr"], stats["optimized_atvr"] = \
+                index.cache_stats(indices, num_vertices)
+
+    # morph target vertex of each exported vertex
+    vertices = attributes.pop("vertex", None)
+
+    # count exported data
+    num_vertices = len(attributes["position"])
+    stats["vertices"] = num_vertices
+    stats["normals"] = num_vertices if "normal" in attributes else 0
+    if indices is not None:
+        stats["faces"] = int(len(indices) / 3)
+    else:
+        stats["faces"] = int(num_vertices / 3)
+
+    # flatten attribute arrays
+    for name, array in attributes.items():
+        attributes[name] = array.ravel()
+
+    # create BufferGeomtry
+    geometry = three.create_buffergeometry(geometry_name,
+                                           attributes["position"],
+                                           attributes.get("normal"),
+                                           attributes.get("uv"),
+                                           attributes.get("color"),
+                                           indices,
+                                           geometry_uuid=geometry_uuid,
+                                           )
+
+    # precompute bounding volumes, before positions are quantized
+    with timings.phase("bounds"):
+        bounds.add_bounding_volumes(geometry,
+                                    attributes["position"].reshape(-1, 3))
+
+    if build_bvh:
+        bvh.add_bvh(geometry, nodes)
+
+    # add morph target deltas of the exported vertices
+    if morph_targets and vertices is not None:
+        vertices = vertices.ravel()
+        three.add_morph_targets(geometry,
+                                [(name, frame, deltas[vertices].ravel())
+                                 for name, frame, deltas in morph_targets],
+                                in_userdata=morph_in_userdata)
+        stats["morph_targets"] = len(morph_targets)
+
+        # morph target deltas are not quantized, so positions must not be
+        if quantize_options is not None:
+            quantize_options = dict(quantize_options,
+                                    quantize_positions=False)
+
+    # convert attributes to narrower typed array types
+    if quantize_options is not None:
+        with timings.phase("quantize"):
+            quantize.quantize_geometry(geometry, **quantize_options)
+
+    return geometry, stats
+
+
+def process_geometry(geometry_name,
+                     geometry_uuid,
+                     attributes,
+                     export_index=True,
+                     quantize_options=None,
+                     optimize_vertex_cache=False,
+                     morph_targets=None,
+                     morph_in_userdata=True,
+                     build_bvh=False,
+                     encode=True,
+                     indent=4,
+                     float_precision=6,
+                     ):
+    '''
+    Builds a BufferGeometry, and optionally encodes it as JSON.
+
+    returns: tuple (stats, geometry, text)
+
+    Either geometry (when encode is False) or text (when encode is True)
+    is None.
+    '''
+    geometry, stats = build_geometry(
+        geometry_name,
+        geometry_uuid,
+        attributes,
+        export_index=export_index,
+        quantize_options=quantize_options,
+        optimize_vertex_cache=optimize_vertex_cache,
+        morph_targets=morph_targets,
+        morph_in_userdata=morph_in_userdata,
+        build_bvh=build_bvh,
+        )
+    if not encode:
+        return stats, geometry, None
+    with stats["timings"].phase("encode"):
+        text = writer.encode_geometry(geometry, indent, float_precision)
+    return stats, None, text
+
+
+class SerialExecutor:
+    '''
+    Runs submitted calls immediately, on the calling thread, with the
+    concurrent.futures.Executor interface.
+    '''
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+def create_executor(processes=1):
+    '''
+    Creates an executor for building geometries.
+
+    processes: number of worker processes. 0 uses one process per cpu
+               core, and 1 builds geometries on the calling thread.
+
+    Worker processes are forked, so they inherit the loaded add-on modules.
+    Geometries are built on the calling thread on platforms that cannot
+    fork.
+    '''
+    if processes == 0:
+        processes = os.cpu_count() or 1
+    if processes <= 1 or \
+            "fork" not in multiprocessing.get_all_start_methods():
+        return SerialExecutor()
+    if sys.version_info >= (3, 7):
+        return ProcessPoolExecutor(
+            processes, mp_context=multiprocessing.get_context("fork"))
+    return ProcessPoolExecutor(processes)
+
+
+class GeometryQueue:
+    '''
+    Builds geometries with process_geometry on an executor, and passes the
+    results to a callback in submission order, so the output does not
+    depend on which worker finishes first.
+
+    The callback is called as callback(tag, stats, geometry, text), where
+    tag is the value passed to submit.
+
+    At most max_pending geometries are queued at once, which bounds the
+    memory used by results that are waiting to be written.
+    '''
+
+    def __init__(self, callback, processes=1):
+        self.callback = callback
+        self.executor = create_executor(processes)
+        self.max_pending = 2 * (os.cpu_count() or 1)
+        self.pending = deque()
+
+    def submit(self, *args, tag=None, **kwargs):
+        '''
+        Queues a process_geometry call
+        '''
+        future = self.executor.submit(process_geometry, *args, **kwargs)
+        self.pending.append((future, tag))
+        self._flush(self.max_pending)
+
+    def submit_result(self, result, tag=None):
+        '''
+        Queues an already built process_geometry result
+        '''
+        future = Future()
+        future.set_result(result)
+        self.pending.append((future, tag))
+        self._flush(self.max_pending)
+
+    def _flush(self, max_pending):
+        pending = self.pending
+        while pending and \
+                (pending[0][0].done() or len(pending) > max_pending):
+            future, tag = pending.popleft()
+            self.callback(tag, *future.result())
+
+    def finish(self):
+        '''
+        Waits for all queued geometries, and shuts down the executor
+        '''
+        self._flush(0)
+        self.executor.shutdown()
+
+    def close(self):
+        '''
+        Cancels all queued geometries, and shuts down the executor
+        '''
+        for future, tag in self.pending:
+            future.cancel()
+        self.pending.clear()
+        self.executor.shutdown()
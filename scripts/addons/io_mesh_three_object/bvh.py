@@ -0,0 +1,247 @@
+import numpy
+from collections import OrderedDict
+
+# This module must not use bpy, since BVHs are built in worker processes.
+
+# BVH node layout, 32 bytes per node:
+#
+#   min, max:  float32 x 3 each, node bounding box
+#   offset:    leaf: index of the first triangle of the leaf
+#              interior: index of the left child node. The right child
+#              node always follows the left child node.
+#   count:     leaf: number of triangles (> 0)
+#              interior: 0
+#   axis:      interior: split axis (0 = x, 1 = y, 2 = z)
+#
+# Node 0 is the root node. Leaf triangles are contiguous, since the
+# geometry triangles are reordered to match the BVH leaves.
+BVH_NODE_DTYPE = numpy.dtype([
+    ("min", "<f4", 3),
+    ("max", "<f4", 3),
+    ("offset", "<u4"),
+    ("count", "<u2"),
+    ("axis", "<u2"),
+])
+
+# number of SAH bins per node
+BVH_BINS = 16
+
+# maximum number of triangles in a leaf node
+BVH_MAX_LEAF_SIZE = 8
+
+# cost of traversing an interior node, relative to a triangle test
+BVH_TRAVERSAL_COST = 3.0
+
+
+def _box_area(box_min, box_max):
+    '''
+    returns: half surface areas of boxes. Empty boxes have no area.
+    '''
+    d = numpy.maximum(box_max - box_min, 0)
+    return d[..., 0] * d[..., 1] + d[..., 1] * d[..., 2] + \
+        d[..., 2] * d[..., 0]
+
+
+def build_bvh(positions,
+              triangles,
+              bins=BVH_BINS,
+              max_leaf_size=BVH_MAX_LEAF_SIZE,
+              ):
+    '''
+    Builds a bounding volume hierarchy over triangles, splitting nodes by
+    the surface area heuristic (SAH) evaluated over bins of triangle
+    centroids.
+
+    The tree is built breadth first: all nodes of a level are binned,
+    evaluated and partitioned together with a few vectorized passes, so
+    the number of python operations grows with the tree depth, not with
+    the number of nodes. Nodes with more than max_leaf_size triangles are
+    always split. Smaller nodes are only split when SAH says splitting is
+    cheaper.
+
+    positions: (n, 3) float array
+    triangles: (t, 3) vertex indices of each triangle
+
+    returns: tuple (nodes, order)
+
+        nodes: BVH_NODE_DTYPE array
+        order: triangle index of each reordered triangle
+    '''
+
+    num_triangles = len(triangles)
+    order = numpy.empty(num_triangles, dtype=numpy.intp)
+    if num_triangles == 0:
+        return numpy.zeros(0, dtype=BVH_NODE_DTYPE), order
+
+    # nodes of each level: ids, triangle counts, and first triangle in the
+    # reordered triangles
+    level_ids = numpy.zeros(1, dtype=numpy.intp)
+    level_counts = numpy.array([num_triangles], dtype=numpy.intp)
+    level_first = numpy.zeros(1, dtype=numpy.intp)
+    num_nodes = 1
+
+    # triangles of the unfinished nodes and their bounds, grouped by node.
+    # the arrays are permuted in place level by level, instead of being
+    # gathered from the full triangle arrays.
+    work = numpy.arange(num_triangles)
+    corners = [positions[triangles[:, i]] for i in range(3)]
+    work_min = numpy.minimum(numpy.minimum(corners[0], corners[1]),
+                             corners[2]).astype(numpy.float32)
+    work_max = numpy.maximum(numpy.maximum(corners[0], corners[1]),
+                             corners[2]).astype(numpy.float32)
+    del corners
+
+    levels = []
+
+    while len(level_ids):
+
+        num_level = len(level_ids)
+        num_work = len(work)
+
+        # nodes of the deeper levels are small, and need fewer bins. At
+        # least two bins are needed for a split.
+        level_bins = int(max(min(bins, level_counts.max()), 2))
+
+        starts = numpy.cumsum(level_counts) - level_counts
+        tri_node = numpy.repeat(numpy.arange(num_level), level_counts)
+        rank = numpy.arange(num_work) - starts[tri_node]
+
+        # node and centroid bounds. centroids are box centers, doubled.
+        centroids = work_min + work_max
+        node_min = numpy.minimum.reduceat(work_min, starts)
+        node_max = numpy.maximum.reduceat(work_max, starts)
+        centroid_min = numpy.minimum.reduceat(centroids, starts)
+        centroid_max = numpy.maximum.reduceat(centroids, starts)
+
+        # bin centroids along the axis of largest centroid extent. Nodes
+        # with coincident centroids are binned by triangle rank instead.
+        extent = centroid_max - centroid_min
+        axis = extent.argmax(axis=1)
+        axis_extent = numpy.take_along_axis(extent, axis[:, None], 1)[:, 0]
+        axis_min = numpy.take_along_axis(centroid_min, axis[:, None], 1)[:, 0]
+        scale = level_bins / numpy.where(axis_extent > 0, axis_extent, 1)
+        tri_bins = numpy.take_along_axis(centroids,
+                                         axis[tri_node][:, None], 1)[:, 0]
+        tri_bins = (tri_bins - axis_min[tri_node]) * scale[tri_node]
+        tri_bins = numpy.where(axis_extent[tri_node] > 0,
+                               tri_bins,
+                               rank * level_bins // level_counts[tri_node])
+        tri_bins = numpy.clip(tri_bins.astype(numpy.intp), 0, level_bins - 1)
+        del centroids
+
+        # group triangles by node and bin. within each node, the
+        # triangles of lower bins come first, so any split partitions
+        # the node.
+        keys = tri_node * level_bins + tri_bins
+        sort = numpy.argsort(keys, kind="stable")
+        keys = keys[sort]
+        work = work[sort]
+        work_min = work_min[sort]
+        work_max = work_max[sort]
+        del sort, tri_bins
+
+        # bin counts and bounds
+        group_starts = numpy.flatnonzero(
+            numpy.concatenate(([True], keys[1:] != keys[:-1])))
+        group_keys = keys[group_starts]
+        num_bins = num_level * level_bins
+        bin_counts = numpy.zeros(num_bins, dtype=numpy.intp)
+        bin_counts[group_keys] = numpy.diff(
+            numpy.append(group_starts, num_work))
+        bin_min = numpy.full((num_bins, 3), numpy.inf, "f4")
+        bin_max = numpy.full((num_bins, 3), -numpy.inf, "f4")
+        bin_min[group_keys] = numpy.minimum.reduceat(work_min, group_starts)
+        bin_max[group_keys] = numpy.maximum.reduceat(work_max, group_starts)
+        bin_counts = bin_counts.reshape(num_level, level_bins)
+        bin_min = bin_min.reshape(num_level, level_bins, 3)
+        bin_max = bin_max.reshape(num_level, level_bins, 3)
+        del keys
+
+        # SAH cost of splitting after each bin
+        left_area = _box_area(numpy.minimum.accumulate(bin_min, axis=1),
+                              numpy.maximum.accumulate(bin_max, axis=1))
+        right_area = _box_area(
+            numpy.minimum.accumulate(bin_min[:, ::-1], axis=1)[:, ::-1],
+            numpy.maximum.accumulate(bin_max[:, ::-1], axis=1)[:, ::-1])
+        left_counts = numpy.cumsum(bin_counts, axis=1)
+        right_counts = level_counts[:, None] - left_counts
+        cost = left_area[:, :-1] * left_counts[:, :-1] + \
+            right_area[:, 1:] * right_counts[:, :-1]
+        cost[(left_counts[:, :-1] == 0) | (right_counts[:, :-1] == 0)] = \
+            numpy.inf
+        best = cost.argmin(axis=1)
+        best_cost = cost[numpy.arange(num_level), best]
+
+        # leaf nodes
+        node_area = _box_area(node_min, node_max)
+        split_cost = BVH_TRAVERSAL_COST + \
+            best_cost / numpy.where(node_area > 0, node_area, 1)
+        leaf = (level_counts <= max_leaf_size) & \
+            ((split_cost >= level_counts) | (node_area <= 0))
+        leaf |= ~numpy.isfinite(best_cost)
+
+        # reorder the triangles of leaf nodes
+        leaf_triangles = leaf[tri_node]
+        order[(level_first[tri_node] + rank)[leaf_triangles]] = \
+            work[leaf_triangles]
+        work = work[~leaf_triangles]
+        work_min = work_min[~leaf_triangles]
+        work_max = work_max[~leaf_triangles]
+        del tri_node, rank, leaf_triangles
+
+        # child nodes of split nodes
+        split = ~leaf
+        num_split = int(split.sum())
+        left_ids = num_nodes + 2 * numpy.arange(num_split)
+        split_left_counts = left_counts[split, best[split]]
+
+        offsets = level_first.copy()
+        offsets[split] = left_ids
+        counts = numpy.where(leaf, level_counts, 0)
+        levels.append((level_ids, node_min, node_max, offsets, counts,
+                       numpy.where(leaf, 0, axis)))
+
+        level_ids = numpy.column_stack((left_ids, left_ids + 1)).ravel()
+        level_counts = numpy.column_stack(
+            (split_left_counts,
+             level_counts[split] - split_left_counts)).ravel()
+        level_first = numpy.column_stack(
+            (level_first[split],
+             level_first[split] + split_left_counts)).ravel()
+        num_nodes += 2 * num_split
+
+    # flat node array
+    nodes = numpy.zeros(num_nodes, dtype=BVH_NODE_DTYPE)
+    for ids, node_min, node_max, offsets, counts, axes in levels:
+        nodes["min"][ids] = node_min
+        nodes["max"][ids] = node_max
+        nodes["offset"][ids] = offsets
+        nodes["count"][ids] = counts
+        nodes["axis"][ids] = axes
+
+    return nodes, order
+
+
+def add_bvh(geometry, nodes):
+    '''
+    Adds a BVH node array to the userData of a BufferGeometry OrderedDict.
+    The node array is moved to the BVH sidecar file by store_bvh.
+    '''
+    user_data = geometry.setdefault("userData", OrderedDict())
+    bvh = user_data["bvh"] = OrderedDict()
+    bvh["nodeCount"] = len(nodes)
+    bvh["type"] = "Uint8Array"
+    bvh["array"] = nodes.view(numpy.uint8)
+
+
+def store_bvh(writer, geometry):
+    '''
+    Moves the BVH node array of a BufferGeometry OrderedDict to a binary
+    sidecar file, and replaces it with byteOffset and byteLength values.
+    '''
+    bvh = geometry.get("userData", {}).get("bvh")
+    if bvh is None or "array" not in bvh:
+        return
+    byte_offset, byte_length = writer.write(bvh.pop("array"), bvh["type"])
+    bvh["byteOffset"] = byte_offset
+    bvh["byteLength"] = byte_length
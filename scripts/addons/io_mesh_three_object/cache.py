@@ -0,0 +1,103 @@
+import os
+import pickle
+
+
+# version of the cache entry format. Entries with a different version are
+# never loaded, since it is part of every fingerprint.
+CACHE_VERSION = 5
+
+CACHE_EXTENSION = ".pickle"
+
+
+class CacheEntry:
+    '''
+    Built geometries of a single mesh object, as stored in the cache.
+
+    geometries is a list of (material_name, geometry_uuid, result) tuples,
+    where result is a pickled build.process_geometry result.
+    '''
+
+    def __init__(self, fingerprint, num_geometries):
+        self.fingerprint = fingerprint
+        self.num_geometries = num_geometries
+        self.geometries = []
+
+    def add(self, material_name, geometry_uuid, result):
+        self.geometries.append((material_name,
+                                geometry_uuid,
+                                pickle.dumps(result, pickle.HIGHEST_PROTOCOL)))
+
+    def is_complete(self):
+        return len(self.geometries) == self.num_geometries
+
+    def results(self):
+        '''
+        Yields (material_name, geometry_uuid, result) tuples
+        '''
+        for material_name, geometry_uuid, result in self.geometries:
+            yield material_name, geometry_uuid, pickle.loads(result)
+
+
+class GeometryCache:
+    '''
+    Persistent cache of built geometries, stored as one file per mesh
+    fingerprint in a directory next to the output file.
+
+    Entries that are not used by an export are removed by prune(), so the
+    cache only holds the geometries of the latest export.
+    '''
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.used = set()
+        os.makedirs(directory, exist_ok=True)
+
+    def _filepath(self, fingerprint):
+        return os.path.join(self.directory, fingerprint + CACHE_EXTENSION)
+
+    def load(self, fingerprint):
+        '''
+        returns: CacheEntry, or None if there is no valid entry
+        '''
+        try:
+            with open(self._filepath(fingerprint), "rb") as file:
+                entry = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError,
+                AttributeError, ImportError, IndexError):
+            return None
+        if not isinstance(entry, CacheEntry) or \
+                entry.fingerprint != fingerprint:
+            return None
+        self.used.add(fingerprint)
+        return entry
+
+    def store(self, entry):
+        '''
+        Writes a complete entry to the cache directory
+        '''
+        filepath = self._filepath(entry.fingerprint)
+        temp_filepath = filepath + ".tmp"
+        with open(temp_filepath, "wb") as file:
+            pickle.dump(entry, file, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_filepath, filepath)
+        self.used.add(entry.fingerprint)
+
+    def prune(self):
+        '''
+        Removes all entries that were not loaded or stored
+        '''
+        for filename in os.listdir(self.directory):
+            name = filename
+            if name.endswith(".tmp"):
+                # incomplete entry
+                name = ""
+            fingerprint, extension = os.path.splitext(name)
+            if extension == CACHE_EXTENSION and fingerprint in self.used:
+                continue
+            if not filename.endswith((CACHE_EXTENSION,
+                                      CACHE_EXTENSION + ".tmp")):
+                continue
+            try:
+                os.remove(os.path.join(self.directory, filename))
+            except OSError:
+                pass
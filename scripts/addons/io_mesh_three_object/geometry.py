@@ -1,6 +1,10 @@
+import bpy
 import bmesh
+import hashlib
+import numpy
 
-from collections import defaultdict
+from collections import OrderedDict
+from . import timing
 
 
 # bmesh constants
@@ -11,12 +15,93 @@ MOD_TRIANGULATE_QUAD_FIXED = 1
 # MOD_TRIANGULATE_QUAD_SHORTEDGE = 3
 MOD_TRIANGULATE_NGON_BEAUTY = 0
 # MOD_TRIANGULATE_NGON_EARCLIP = 1
-# DEL_VERTS = 1
-# DEL_EDGES = 2
-# DEL_ONLYFACES = 3
-# DEL_EDGESFACES = 4
-DEL_FACES = 5
-# DEL_ONLYTAGGED = 6
+
+# modifier properties that do not change the modifier result
+MODIFIER_SIGNATURE_IGNORE = {
+    "rna_type",
+    "name",
+    "show_viewport",
+    "show_render",
+    "show_in_editmode",
+    "show_on_cage",
+    "show_expanded",
+}
+
+
+def _hashable(value):
+    '''
+    Converts a property value into a hashable value
+    '''
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(value))
+    try:
+        return tuple(_hashable(v) for v in value)
+    except TypeError:
+        return repr(value)
+
+
+def _pointer_signature(mesh_object, value):
+    '''
+    Converts a modifier pointer property value into a hashable value.
+
+    Referenced objects are stored by name and by their transform relative
+    to the mesh object, since that is what the modifier result depends on.
+    '''
+    if value is None:
+        return None
+    if isinstance(value, bpy.types.Object):
+        try:
+            matrix = mesh_object.matrix_world.inverted() * value.matrix_world
+        except ValueError:
+            # degenerate mesh object transform
+            return repr(value)
+        return ("OBJECT", value.name, _hashable(matrix))
+    if isinstance(value, bpy.types.ID):
+        return (type(value).__name__, value.name)
+    return repr(value)
+
+
+def modifier_signature(mesh_object, apply_modifiers=True):
+    '''
+    Creates a hashable signature of the render modifier stack for the
+    specified mesh object.
+
+    Mesh objects that share a mesh datablock, and have equal modifier
+    signatures, will produce identical exported geometry.
+
+    returns: tuple (empty when modifiers are not applied)
+    '''
+
+    if not apply_modifiers:
+        return ()
+
+    signature = []
+
+    for modifier in mesh_object.modifiers:
+
+        # modifiers disabled for rendering are not evaluated
+        if not modifier.show_render:
+            continue
+
+        settings = [modifier.type]
+        for prop in modifier.bl_rna.properties:
+            identifier = prop.identifier
+            if identifier in MODIFIER_SIGNATURE_IGNORE:
+                continue
+            if prop.type == "COLLECTION":
+                continue
+            value = getattr(modifier, identifier)
+            if prop.type == "POINTER":
+                value = _pointer_signature(mesh_object, value)
+            else:
+                value = _hashable(value)
+            settings.append((identifier, value))
+
+        signature.append(tuple(settings))
+
+    return tuple(signature)
 
 
 def map_mesh_object(mesh_object,
@@ -24,11 +109,15 @@ def map_mesh_object(mesh_object,
                     global_matrix,
                     apply_modifiers=True,
                     split_by_material=True,
-                    export_normals=True
+                    export_normals=True,
+                    export_uvs=True,
+                    export_colors=True,
+                    export_vertex_index=False,
+                    timings=None,
                     ):
     '''
-    Creates a map of assigned mesh materials to bmesh data for the specified
-    mesh object.
+    Creates a map of assigned mesh materials to vertex attribute arrays for
+    the specified mesh object.
 
     The returned map keys represent assigned mesh materials, and may be None.
 
@@ -36,100 +125,350 @@ def map_mesh_object(mesh_object,
     the material is set in multiple material slots and the faces have a
     different material_index.
 
-    The returned bmesh data is already triangulated and in a suitable for
-    exporting to Three.js. For non-indexed BufferGeometry, it can be exported
-    as-is. Indexed BufferGeometry will still need to map the bmesh verts.
+    The mesh is triangulated, and its attributes extracted, only once.
+    Triangles are then bucketed by material in a single pass.
+
+    The returned attribute arrays are per-loop, as returned by
+    extract_attributes, and are suitable for exporting to Three.js as
+    non-indexed BufferGeometry as-is. Indexed BufferGeometry will still need
+    to weld the loops.
+
+    The time spent in each phase is added to timings, if given.
 
     returns: dict (always with at least one key)
 
     example:
     {
-        None: <BMesh(0x000000E9600D8518)>,
-        <Material>: <BMesh(0x000000E9600D8518)>,
-        <Material.001>: <BMesh(0x000000E9600D8518)>
+        None: {"position": array([[x, y, z], ...]), ...},
+        <Material>: {"position": array([[x, y, z], ...]), ...},
+        <Material.001>: {"position": array([[x, y, z], ...]), ...}
     }
 
     '''
 
-    bm = bmesh.new()
-
-    if apply_modifiers:
-        # use modified object data
-        bm.from_object(mesh_object, scene, render=True, face_normals=False)
-
-    else:
-        # use un-modified object data
-        bm.from_mesh(mesh_object.data, face_normals=False)
-
-    # transform bmesh verts to three.js coords, and scale
-    bm.transform(global_matrix)
+    if timings is None:
+        timings = timing.Timings()
 
-    # bake flat faces into the bmesh
-    flat_edges = set()
-    for face in bm.faces:
-        if not face.smooth:
-            flat_edges.update(face.edges)
-    bmesh.ops.split_edges(bm, edges=list(flat_edges))
+    bm = bmesh.new()
+    modified_mesh = None
 
-    # triangulate bmesh data (gets rid of ngons?)
-    bm.calc_tessface()
+    try:
 
-    bmesh.ops.triangulate(bm,
-                          faces=bm.faces,
-                          quad_method=MOD_TRIANGULATE_QUAD_FIXED,
-                          ngon_method=MOD_TRIANGULATE_NGON_BEAUTY)
+        if apply_modifiers:
+            # use modified object data. modifiers are evaluated into a
+            # temporary mesh first, so they are timed separately.
+            with timings.phase("modifiers"):
+                modified_mesh = mesh_object.to_mesh(scene, True, "RENDER",
+                                                    calc_tessface=False)
+            source_mesh = modified_mesh
 
-    # re-calculate normals
-    if export_normals:
-        bm.normal_update()
+        else:
+            # use un-modified object data
+            source_mesh = mesh_object.data
+
+        with timings.phase("bmesh"):
+            bm.from_mesh(source_mesh, face_normals=False)
+
+            # transform bmesh verts to three.js coords, and scale
+            bm.transform(global_matrix)
+
+            # mirroring transforms (negative scale) reverse the winding
+            # of faces, so they are flipped back
+            if global_matrix.determinant() < 0:
+                bmesh.ops.reverse_faces(bm, faces=bm.faces)
+
+        with timings.phase("triangulate"):
+
+            # triangulate quads and ngons only. bmesh faces keep the order
+            # of the source mesh polygons, so they are found from the
+            # polygon sizes, read in bulk. Meshes that are all triangles
+            # are not triangulated at all.
+            loop_total = numpy.empty(len(source_mesh.polygons),
+                                     dtype=numpy.int32)
+            source_mesh.polygons.foreach_get("loop_total", loop_total)
+            ngons = numpy.flatnonzero(loop_total > 3)
+
+            if len(ngons) == len(loop_total):
+                faces = bm.faces
+            else:
+                bm.faces.ensure_lookup_table()
+                faces = [bm.faces[i] for i in ngons.tolist()]
+
+            if faces:
+                bmesh.ops.triangulate(
+                    bm,
+                    faces=faces,
+                    quad_method=MOD_TRIANGULATE_QUAD_FIXED,
+                    ngon_method=MOD_TRIANGULATE_NGON_BEAUTY)
+
+        with timings.phase("extract"):
+
+            # re-calculate normals
+            if export_normals:
+                bm.normal_update()
+
+            # extract vertex attributes of all triangles. flat faces are
+            # not split, since loop normals are extracted per face.
+            attributes, material_indices = extract_attributes(
+                bm,
+                export_normals=export_normals,
+                export_uvs=export_uvs,
+                export_colors=export_colors,
+                export_vertex_index=export_vertex_index,
+                source_mesh=mesh_object.data,
+                )
+
+    finally:
+
+        # free bmesh and the modified mesh
+        bm.free()
+        if modified_mesh is not None:
+            bpy.data.meshes.remove(modified_mesh)
 
     # determine if the mesh should be split by material.
     materials = mesh_object.data.materials
     num_materials = len(materials)
     if not split_by_material or num_materials <= 1:
 
-        # return bmesh as-is mapped to first material
-        bm.verts.index_update()
-        bm.faces.index_update()
+        # return attributes as-is mapped to first material
         material = materials[0] if num_materials else None
-        return {material: bm}
+        return {material: attributes}
+
+    with timings.phase("split"):
+
+        # map material slot indexes to unique mesh materials
+        unique_materials = []
+        slot_map = numpy.empty(num_materials, dtype=numpy.intp)
+        for material_index, material in enumerate(materials):
+            if material not in unique_materials:
+                unique_materials.append(material)
+            slot_map[material_index] = unique_materials.index(material)
+
+        # bucket triangles by material. a stable sort keeps the face order
+        # within each bucket.
+        material_indices = numpy.minimum(material_indices, num_materials - 1)
+        triangle_materials = slot_map[material_indices]
+        triangle_order = numpy.argsort(triangle_materials, kind="mergesort")
+        counts = numpy.bincount(triangle_materials,
+                                minlength=len(unique_materials))
+        loop_order = (triangle_order[:, None] * 3 + numpy.arange(3)).ravel()
+        for name, array in attributes.items():
+            attributes[name] = array[loop_order]
+
+        result = {}
+
+        # slice the bucket of each material
+        start = 0
+        for material, count in zip(unique_materials, counts.tolist()):
+            if count:
+                result[material] = OrderedDict(
+                    (name, array[3 * start:3 * (start + count)])
+                    for name, array in attributes.items())
+            start += count
+
+    # all done
+    return result
 
-    # map unique mesh materials to their slot indexes
-    material_map = defaultdict(list)
-    for material_index, material in enumerate(materials):
-        material_map[material].append(material_index)
 
-    result = {}
+def _references_data(mesh_object):
+    '''
+    Returns True if any render modifier of the mesh object references other
+    data (objects, textures, caches etc.)
+    '''
+    for modifier in mesh_object.modifiers:
+        if not modifier.show_render:
+            continue
+        for prop in modifier.bl_rna.properties:
+            if prop.type == "POINTER" and \
+                    prop.identifier not in MODIFIER_SIGNATURE_IGNORE and \
+                    getattr(modifier, prop.identifier) is not None:
+                return True
+    return False
+
+
+def mesh_fingerprint(mesh_object,
+                     scene,
+                     apply_modifiers=True,
+                     options=(),
+                     ):
+    '''
+    Creates a content fingerprint for the exported geometry of a mesh
+    object, from its mesh data, render modifier stack, and the specified
+    hashable export options.
 
-    # process each material
-    for material, index_list in material_map.items():
+    Unlike modifier_signature, the fingerprint does not depend on datablock
+    identity, so it can be compared between Blender sessions.
 
-        # make a copy of the mesh data
-        material_bm = bm.copy()
+    Geometry that depends on other data (modifiers that reference objects,
+    textures or caches) cannot be fingerprinted from the mesh object alone.
 
-        # delete unwanted faces
-        del_faces = [f for f in material_bm.faces
-                     if f.material_index not in index_list]
-        bmesh.ops.delete(material_bm, geom=del_faces, context=DEL_FACES)
+    returns: str (hex digest), or None
+    '''
 
-        if len(material_bm.faces) == 0:
+    signature = modifier_signature(mesh_object, apply_modifiers)
+    if signature and _references_data(mesh_object):
+        return None
+
+    mesh = mesh_object.data
+    digest = hashlib.sha1()
+
+    def update(collection, attribute, item_size, dtype):
+        array = numpy.empty(len(collection) * item_size, dtype=dtype)
+        collection.foreach_get(attribute, array)
+        digest.update(array.tobytes())
+
+    # names that end up in the output, and options
+    material_names = [m.name if m else None for m in mesh.materials]
+    digest.update(repr((mesh.name,
+                        material_names,
+                        mesh.use_auto_smooth,
+                        mesh.auto_smooth_angle,
+                        signature,
+                        options)).encode("utf8"))
+
+    # evaluated modifiers may depend on the current frame
+    if signature:
+        digest.update(repr(scene.frame_current).encode("utf8"))
+
+    # topology, and face attributes
+    update(mesh.vertices, "co", 3, numpy.float32)
+    update(mesh.edges, "vertices", 2, numpy.int32)
+    update(mesh.edges, "use_edge_sharp", 1, numpy.bool_)
+    update(mesh.loops, "vertex_index", 1, numpy.int32)
+    update(mesh.polygons, "loop_start", 1, numpy.int32)
+    update(mesh.polygons, "loop_total", 1, numpy.int32)
+    update(mesh.polygons, "material_index", 1, numpy.int32)
+    update(mesh.polygons, "use_smooth", 1, numpy.bool_)
+
+    # custom split normals
+    if mesh.has_custom_normals:
+        mesh.calc_normals_split()
+        update(mesh.loops, "normal", 3, numpy.float32)
+        mesh.free_normals_split()
+
+    # active loop layers
+    if mesh.uv_layers.active:
+        update(mesh.uv_layers.active.data, "uv", 2, numpy.float32)
+    if mesh.vertex_colors.active:
+        update(mesh.vertex_colors.active.data, "color", 3, numpy.float32)
+
+    # shape keys
+    if mesh.shape_keys:
+        for key_block in mesh.shape_keys.key_blocks:
+            digest.update(repr((key_block.name,
+                                key_block.value,
+                                key_block.mute,
+                                key_block.relative_key.name,
+                                key_block.vertex_group,
+                                )).encode("utf8"))
+            update(key_block.data, "co", 3, numpy.float32)
+
+    # vertex group weights only matter to modifiers
+    if signature and mesh_object.vertex_groups:
+        digest.update(repr([g.name for g in mesh_object.vertex_groups])
+                      .encode("utf8"))
+        weights = [(v.index, g.group, g.weight)
+                   for v in mesh.vertices for g in v.groups]
+        digest.update(numpy.array(weights, dtype=numpy.float64).tobytes())
+
+    return digest.hexdigest()
+
+
+def extract_attributes(bm,
+                       export_normals=True,
+                       export_uvs=True,
+                       export_colors=True,
+                       export_vertex_index=False,
+                       source_mesh=None,
+                       ):
+    '''
+    Extracts per-loop vertex attribute arrays from triangulated bmesh data.
 
-            # no faces left after deleting unwanted faces
-            material_bm.free()
+    The bmesh data is written to a temporary mesh datablock, so that every
+    attribute can be read in bulk with foreach_get, instead of accessing
+    each BMLoop from python.
 
-        else:
+    Normals are split (per-loop) normals: the face normal for flat faces,
+    and the vertex normal for smooth faces. The auto smooth settings of
+    source_mesh are used, so sharp edges, the auto smooth angle and custom
+    split normals are respected.
 
-            # reset face material_index
-            for f in material_bm.faces:
-                f.material_index = 0
+    export_vertex_index adds a "vertex" array with the bmesh vertex index of
+    each loop, which maps loops to morph target vertices.
 
-            # add material/mesh to map
-            material_bm.verts.index_update()
-            material_bm.faces.index_update()
-            result[material] = material_bm
+    Loops are returned in face order, so every three consecutive rows
+    form a triangle.
 
-    # free original bmesh
-    bm.free()
+    returns: tuple (attributes, material_indices)
 
-    # all done
-    return result
+        attributes: OrderedDict of float32 arrays shaped (loops, itemSize)
+        material_indices: int32 array with the material_index of each face
+
+    example:
+    ({
+        "position": array([[x, y, z], ...]),
+        "normal": array([[x, y, z], ...]),
+        "uv": array([[u, v], ...]),
+        "color": array([[r, g, b], ...]),
+        "vertex": array([[i], ...])
+    }, array([0, 0, 1, ...]))
+
+    '''
+
+    mesh = bpy.data.meshes.new("io_mesh_three_object.tmp")
+
+    try:
+
+        bm.to_mesh(mesh)
+
+        if source_mesh:
+            mesh.use_auto_smooth = source_mesh.use_auto_smooth
+            mesh.auto_smooth_angle = source_mesh.auto_smooth_angle
+
+        num_vertices = len(mesh.vertices)
+        num_loops = len(mesh.loops)
+
+        # loop -> vertex map
+        vertex_index = numpy.empty(num_loops, dtype=numpy.int32)
+        mesh.loops.foreach_get("vertex_index", vertex_index)
+
+        result = OrderedDict()
+
+        # per-vertex attributes
+        positions = numpy.empty(num_vertices * 3, dtype=numpy.float32)
+        mesh.vertices.foreach_get("co", positions)
+        result["position"] = positions.reshape(-1, 3)[vertex_index]
+
+        # per-loop attributes
+        if export_normals:
+            mesh.calc_normals_split()
+            normals = numpy.empty(num_loops * 3, dtype=numpy.float32)
+            mesh.loops.foreach_get("normal", normals)
+            result["normal"] = normals.reshape(-1, 3)
+            mesh.free_normals_split()
+
+        uv_layer = mesh.uv_layers.active if export_uvs else None
+        if uv_layer:
+            uvs = numpy.empty(num_loops * 2, dtype=numpy.float32)
+            uv_layer.data.foreach_get("uv", uvs)
+            result["uv"] = uvs.reshape(-1, 2)
+
+        color_layer = mesh.vertex_colors.active if export_colors else None
+        if color_layer:
+            colors = numpy.empty(num_loops * 3, dtype=numpy.float32)
+            color_layer.data.foreach_get("color", colors)
+            result["color"] = colors.reshape(-1, 3)
+
+        if export_vertex_index:
+            result["vertex"] = vertex_index.reshape(-1, 1)
+
+        # per-face material indexes
+        material_indices = numpy.empty(len(mesh.polygons), dtype=numpy.int32)
+        mesh.polygons.foreach_get("material_index", material_indices)
+
+    finally:
+
+        # always remove the temporary mesh
+        bpy.data.meshes.remove(mesh)
+
+    return result, material_indices
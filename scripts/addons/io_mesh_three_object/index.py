@@ -0,0 +1,203 @@
+import numpy
+
+
+def weld(arrays):
+    '''
+    Finds the unique vertices in a set of per-loop vertex attribute arrays.
+
+    Each loop is packed into a fixed size record of raw attribute bytes, and
+    the records are compared exactly with a lexicographic sort. Different
+    vertices are never merged, and no python objects are created per loop.
+
+    All arrays must be 2d, have one row per loop, and have 4 byte items
+    (float32, int32 or uint32).
+
+    Unique vertices are numbered in order of first use.
+
+    returns: tuple (loops, indices)
+
+        loops: index of the first loop of each unique vertex
+        indices: uint32 vertex index of each loop
+
+    example:
+
+        loops, indices = weld([positions, normals])
+        positions = positions[loops]
+        normals = normals[loops]
+    '''
+
+    num_loops = len(arrays[0])
+    width = sum(array.shape[1] for array in arrays)
+
+    if num_loops == 0:
+        return (numpy.empty(0, dtype=numpy.intp),
+                numpy.empty(0, dtype=numpy.uint32))
+
+    # pack loop attributes into records
+    records = numpy.empty((num_loops, width), dtype=numpy.uint32)
+    column = 0
+    for array in arrays:
+        if array.dtype.kind == "f":
+            # -0.0 and 0.0 are the same value
+            array = array + array.dtype.type(0)
+        else:
+            array = numpy.ascontiguousarray(array)
+        records[:, column:column + array.shape[1]] = array.view(numpy.uint32)
+        column += array.shape[1]
+
+    # view each record as a single opaque value, so unique compares rows
+    records = records.view(numpy.dtype((numpy.void, 4 * width))).ravel()
+
+    # sorted unique records. return_index uses a stable sort, so first
+    # is the first loop that uses each unique record.
+    first, inverse = numpy.unique(records,
+                                  return_index=True,
+                                  return_inverse=True)[1:]
+    del records
+
+    # renumber unique vertices in order of first use
+    order = numpy.argsort(first, kind="mergesort")
+    rank = numpy.empty(len(order), dtype=numpy.uint32)
+    rank[order] = numpy.arange(len(order), dtype=numpy.uint32)
+
+    return first[order], rank[inverse.ravel()]
+
+
+# post-transform vertex cache size used for optimization and statistics
+VERTEX_CACHE_SIZE = 16
+
+
+def count_cache_misses(indices, num_vertices, cache_size=VERTEX_CACHE_SIZE):
+    '''
+    Simulates a FIFO post-transform vertex cache over an index array.
+
+    returns: number of cache misses (transformed vertices)
+    '''
+    # miss count at which each vertex was last added to the cache
+    added = [-cache_size] * num_vertices
+    misses = 0
+    for vertex in indices.tolist():
+        if misses - added[vertex] >= cache_size:
+            added[vertex] = misses
+            misses += 1
+    return misses
+
+
+def cache_stats(indices, num_vertices, cache_size=VERTEX_CACHE_SIZE):
+    '''
+    returns: tuple (ACMR, ATVR)
+
+        ACMR: average cache miss ratio, transformed vertices per triangle
+        ATVR: average transform to vertex ratio, transformed vertices per
+              vertex (1.0 is optimal)
+    '''
+    if not len(indices) or not num_vertices:
+        return 0.0, 0.0
+    misses = count_cache_misses(indices, num_vertices, cache_size)
+    return misses / (len(indices) / 3), misses / num_vertices
+
+
+def tipsify(indices, num_vertices, cache_size=VERTEX_CACHE_SIZE):
+    '''
+    Reorders triangles for the post-transform vertex cache, using the
+    Tipsify algorithm (Sander, Nehab, Barczak 2007).
+
+    returns: uint32 index array with the same triangles in a new order
+    '''
+
+    num_triangles = len(indices) // 3
+    if not num_triangles:
+        return indices
+
+    # vertex -> triangles adjacency, as compressed rows
+    triangle_of_index = numpy.arange(len(indices)) // 3
+    order = numpy.argsort(indices, kind="mergesort")
+    adjacency = triangle_of_index[order].tolist()
+    offsets = numpy.zeros(num_vertices + 1, dtype=numpy.intp)
+    numpy.cumsum(numpy.bincount(indices, minlength=num_vertices),
+                 out=offsets[1:])
+    offsets = offsets.tolist()
+
+    triangles = indices.reshape(-1, 3).tolist()
+
+    # live triangle count, and cache time stamp of each vertex
+    live = numpy.diff(offsets).tolist()
+    stamp = [0] * num_vertices
+    emitted = [False] * num_triangles
+    dead_end = []
+    output = []
+
+    time = cache_size + 1
+    cursor = 0
+    fanning = 0
+
+    while fanning >= 0:
+
+        # emit all remaining triangles around the fanning vertex
+        candidates = []
+        for t in adjacency[offsets[fanning]:offsets[fanning + 1]]:
+            if emitted[t]:
+                continue
+            emitted[t] = True
+            triangle = triangles[t]
+            output.append(triangle)
+            for v in triangle:
+                dead_end.append(v)
+                candidates.append(v)
+                live[v] -= 1
+                if time - stamp[v] > cache_size:
+                    stamp[v] = time
+                    time += 1
+
+        # choose the next fanning vertex. prefer vertices still in the
+        # cache that will not be evicted while their triangles are emitted
+        fanning = -1
+        best = -1
+        for v in candidates:
+            if live[v] > 0:
+                priority = 0
+                if time - stamp[v] + 2 * live[v] <= cache_size:
+                    priority = time - stamp[v]
+                if priority > best:
+                    best = priority
+                    fanning = v
+
+        # dead end. try recently used vertices, then the next vertex
+        # in input order
+        if fanning < 0:
+            while dead_end:
+                v = dead_end.pop()
+                if live[v] > 0:
+                    fanning = v
+                    break
+            else:
+                while cursor < num_vertices:
+                    if live[cursor] > 0:
+                        fanning = cursor
+                        break
+                    cursor += 1
+
+    return numpy.array(output, dtype=numpy.uint32).ravel()
+
+
+def reorder_vertices(indices):
+    '''
+    Renumbers vertices in order of first use by an index array, so vertex
+    data is fetched sequentially.
+
+    returns: tuple (vertices, indices)
+
+        vertices: old index of each new vertex
+        indices: renumbered uint32 index array
+
+    example:
+
+        vertices, indices = reorder_vertices(indices)
+        positions = positions[vertices]
+    '''
+    vertices, first = numpy.unique(indices, return_index=True)
+    vertices = vertices[numpy.argsort(first, kind="mergesort")]
+    remap = numpy.zeros(int(vertices.max()) + 1 if len(vertices) else 0,
+                        dtype=numpy.uint32)
+    remap[vertices] = numpy.arange(len(vertices), dtype=numpy.uint32)
+    return vertices, remap[indices]
@@ -1,9 +1,13 @@
 import json
+import numpy
 from uuid import UUID
 from mathutils import Matrix
 
 JSON_FLOAT_PRECISION = 6
 
+# number of numpy array elements formatted per yielded chunk
+JSON_ARRAY_CHUNK_SIZE = 65536
+
 
 def _make_iterencode(markers,
                      _default,
@@ -15,8 +19,10 @@ def _make_iterencode(markers,
                      _sort_keys,
                      _skipkeys,
                      _one_shot,
+                     _float_precision=JSON_FLOAT_PRECISION,
                      ):
     '''
+    Creates a JSON iterencode function, based on json.encoder._make_iterencode
     '''
 
     def _float_str(o):
@@ -26,9 +32,9 @@ def _make_iterencode(markers,
         when it's more compact.
         '''
 
-        o = round(o, JSON_FLOAT_PRECISION)
-        o = float("%.*f" % (JSON_FLOAT_PRECISION, o))
-        return "%.*g" % (JSON_FLOAT_PRECISION, o)
+        o = round(o, _float_precision)
+        o = float("%.*f" % (_float_precision, o))
+        return "%.*g" % (_float_precision, o)
 
     def _matrix_list(o):
         '''
@@ -41,6 +47,33 @@ def _make_iterencode(markers,
             flat_list_extend(t)
         return flat_list
 
+    def _iterencode_array(a):
+        '''
+        Encodes a numpy array as a flat list of numbers.
+
+        Floats are rounded in a single vectorized pass, and every element is
+        then formatted with the same precomputed format template, so the
+        whole array is encoded in a few large chunks instead of one chunk
+        per element.
+        '''
+        a = a.ravel()
+        if not len(a):
+            yield '[]'
+            return
+        if a.dtype.kind == 'f':
+            a = numpy.round(a.astype(numpy.float64), _float_precision)
+            number_str = ('%%.%dg' % (_float_precision)).__mod__
+        elif a.dtype.kind == 'b':
+            number_str = {True: 'true', False: 'false'}.__getitem__
+        else:
+            number_str = int.__repr__
+        buf = '['
+        for start in range(0, len(a), JSON_ARRAY_CHUNK_SIZE):
+            chunk = a[start:start + JSON_ARRAY_CHUNK_SIZE].tolist()
+            yield buf + _item_separator.join(map(number_str, chunk))
+            buf = _item_separator
+        yield ']'
+
     def _iterencode_list(l, level):
         '''
 
@@ -195,6 +228,9 @@ def _make_iterencode(markers,
         elif isinstance(o, Matrix):
             for chunk in _iterencode_list(_matrix_list(o), level):
                 yield chunk
+        elif isinstance(o, numpy.ndarray):
+            for chunk in _iterencode_array(o):
+                yield chunk
         else:
             if markers is not None:
                 markerid = id(o)
@@ -213,5 +249,50 @@ def _make_iterencode(markers,
     return _iterencode
 
 
-# override native json encoder _make_iterencode
-json.encoder._make_iterencode = _make_iterencode
+class JSONEncoder(json.JSONEncoder):
+    '''
+    JSON encoder for Three.js Object files.
+
+    Encodes UUID, Matrix and numpy array values, rounds floats to
+    float_precision, and skips empty dict and list values in objects.
+
+    It is only used by this add-on, so the standard json encoder (and its C
+    accelerated version) is left unchanged for other scripts.
+    '''
+
+    def __init__(self, float_precision=JSON_FLOAT_PRECISION, **kwargs):
+        super().__init__(**kwargs)
+        self.float_precision = float_precision
+
+    def iterencode(self, o, _one_shot=False, level=0):
+        '''
+        Encodes a value as JSON string chunks, starting at the specified
+        indentation level.
+        '''
+        if self.ensure_ascii:
+            _encoder = json.encoder.encode_basestring_ascii
+        else:
+            _encoder = json.encoder.encode_basestring
+        _iterencode = _make_iterencode({} if self.check_circular else None,
+                                       self.default,
+                                       _encoder,
+                                       self.indent,
+                                       None,
+                                       self.key_separator,
+                                       self.item_separator,
+                                       self.sort_keys,
+                                       self.skipkeys,
+                                       _one_shot,
+                                       _float_precision=self.float_precision,
+                                       )
+        return _iterencode(o, level)
+
+
+def iterencode(o, indent=4, level=0, float_precision=JSON_FLOAT_PRECISION):
+    '''
+    Encodes a value as JSON string chunks, using the same formatting as
+    json.dump(o, fp, indent=indent, cls=JSONEncoder), but starting at the
+    specified indentation level.
+    '''
+    encoder = JSONEncoder(indent=indent, float_precision=float_precision)
+    return encoder.iterencode(o, level=level)
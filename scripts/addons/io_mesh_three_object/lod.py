@@ -0,0 +1,53 @@
+from contextlib import contextmanager
+
+
+# name of the temporary decimate modifier
+LOD_MODIFIER_NAME = "io_mesh_three_object.lod"
+
+
+def level_ratios(lod_levels, lod_ratio):
+    '''
+    Returns the decimation ratio of each level of detail, relative to the
+    full resolution mesh. Each level keeps lod_ratio of the triangles of
+    the previous level.
+    '''
+    return [lod_ratio ** level for level in range(1, lod_levels + 1)]
+
+
+@contextmanager
+def decimated(mesh_object, ratio, apply_modifiers=True):
+    '''
+    Temporarily adds a collapse Decimate modifier to the end of the
+    modifier stack of a mesh object, so its evaluated mesh is a
+    simplified level of detail.
+
+    Collapse decimation is Blender's quadric error edge collapse, which
+    keeps uvs, vertex colors and material boundaries, and is fast enough
+    for meshes of millions of triangles.
+
+    When apply_modifiers is False, the other modifiers are disabled for
+    rendering until the context exits, so only the decimation is applied.
+    '''
+
+    disabled = []
+    if not apply_modifiers:
+        for modifier in mesh_object.modifiers:
+            if modifier.show_render:
+                modifier.show_render = False
+                disabled.append(modifier)
+
+    modifier = mesh_object.modifiers.new(LOD_MODIFIER_NAME, "DECIMATE")
+
+    try:
+
+        modifier.decimate_type = "COLLAPSE"
+        modifier.ratio = ratio
+        modifier.use_collapse_triangulate = True
+        yield modifier
+
+    finally:
+
+        # always restore the modifier stack
+        mesh_object.modifiers.remove(modifier)
+        for disabled_modifier in disabled:
+            disabled_modifier.show_render = True
@@ -0,0 +1,280 @@
+import bpy
+import bmesh
+import numpy
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+# modifier types that deform vertices without changing topology, and whose
+# result may be animated
+DEFORM_MODIFIER_TYPES = {
+    "ARMATURE",
+    "CAST",
+    "CURVE",
+    "DISPLACE",
+    "HOOK",
+    "LAPLACIANDEFORM",
+    "LATTICE",
+    "MESH_CACHE",
+    "MESH_DEFORM",
+    "SHRINKWRAP",
+    "SIMPLE_DEFORM",
+    "SMOOTH",
+    "WARP",
+    "WAVE",
+}
+
+# morph targets with no vertex moving further than this are skipped
+MORPH_TOLERANCE = 1e-6
+
+
+def has_shape_keys(mesh_object):
+    '''
+    Returns True if the mesh has shape keys other than the basis
+    '''
+    shape_keys = mesh_object.data.shape_keys
+    return shape_keys is not None and len(shape_keys.key_blocks) > 1
+
+
+def is_animated(id_data):
+    '''
+    Returns True if a datablock has an action or drivers. Objects are also
+    animated when one of their parents is.
+    '''
+    while id_data is not None:
+        animation_data = getattr(id_data, "animation_data", None)
+        if animation_data and (animation_data.action or
+                               len(animation_data.drivers)):
+            return True
+        id_data = getattr(id_data, "parent", None)
+    return False
+
+
+def has_deform_animation(mesh_object, apply_modifiers=True):
+    '''
+    Returns True if the mesh vertices are deformed by animation, either by
+    animated shape keys, or by deform modifiers that are animated or that
+    follow animated data (armatures, hooks, lattices, textures etc.)
+
+    Deform modifiers of static scenes do not animate anything, so they are
+    exported as part of the basis shape only.
+    '''
+    shape_keys = mesh_object.data.shape_keys
+    if has_shape_keys(mesh_object) and is_animated(shape_keys):
+        return True
+    if not apply_modifiers:
+        return False
+    for modifier in mesh_object.modifiers:
+        if not modifier.show_render or \
+                modifier.type not in DEFORM_MODIFIER_TYPES:
+            continue
+
+        # mesh caches are read for the current frame
+        if modifier.type == "MESH_CACHE":
+            return True
+
+        # modifier settings are animated by the object action or drivers
+        if is_animated(mesh_object):
+            return True
+
+        # objects and textures referenced by the modifier
+        for prop in modifier.bl_rna.properties:
+            if prop.type == "POINTER" and \
+                    is_animated(getattr(modifier, prop.identifier)):
+                return True
+
+    return False
+
+
+def has_morph_targets(mesh_object, apply_modifiers=True):
+    '''
+    Returns True if morph targets can be exported for the mesh object
+    '''
+    return has_shape_keys(mesh_object) or \
+        has_deform_animation(mesh_object, apply_modifiers)
+
+
+@contextmanager
+def basis_shape(mesh_object, shape_key_index=0):
+    '''
+    Temporarily shows only one shape key of a mesh object (the basis by
+    default), so its evaluated mesh has no other shape keys mixed in.
+    '''
+    if not has_shape_keys(mesh_object):
+        yield
+        return
+    show_only_shape_key = mesh_object.show_only_shape_key
+    active_shape_key_index = mesh_object.active_shape_key_index
+    try:
+        mesh_object.show_only_shape_key = True
+        mesh_object.active_shape_key_index = shape_key_index
+        yield
+    finally:
+        mesh_object.show_only_shape_key = show_only_shape_key
+        mesh_object.active_shape_key_index = active_shape_key_index
+
+
+class MorphSampler:
+    '''
+    Samples the evaluated vertex positions of a mesh object, and collects
+    its morph targets relative to the basis shape.
+
+    One bmesh, one temporary mesh datablock and one position buffer are
+    reused for every sample.
+    '''
+
+    def __init__(self, mesh_object, scene, global_matrix,
+                 apply_modifiers=True):
+        self.mesh_object = mesh_object
+        self.scene = scene
+        self.apply_modifiers = apply_modifiers
+        matrix = numpy.array(global_matrix, dtype=numpy.float64)
+        self.rotation = matrix[:3, :3].T
+        self.translation = matrix[:3, 3]
+        self.bm = bmesh.new()
+        self.mesh = bpy.data.meshes.new("io_mesh_three_object.morph")
+        self.buffer = numpy.empty(0, dtype=numpy.float32)
+        self.basis = None
+        self.shape_key_deltas = []
+        self.targets = []
+
+    def sample(self, shape_key_index=None):
+        '''
+        returns: float32 array of transformed positions, shaped (verts, 3)
+
+        shape_key_index reads a shape key without modifiers, when modifiers
+        are not applied.
+        '''
+        bm = self.bm
+        bm.clear()
+        if self.apply_modifiers:
+            bm.from_object(self.mesh_object, self.scene, render=True,
+                           face_normals=False)
+        elif shape_key_index is not None:
+            bm.from_mesh(self.mesh_object.data, face_normals=False,
+                         use_shape_key=True,
+                         shape_key_index=shape_key_index)
+        else:
+            bm.from_mesh(self.mesh_object.data, face_normals=False)
+        bm.to_mesh(self.mesh)
+
+        num_values = len(self.mesh.vertices) * 3
+        if len(self.buffer) != num_values:
+            self.buffer = numpy.empty(num_values, dtype=numpy.float32)
+        self.mesh.vertices.foreach_get("co", self.buffer)
+
+        positions = self.buffer.reshape(-1, 3).dot(self.rotation)
+        positions += self.translation
+        return positions.astype(numpy.float32)
+
+    def add_target(self, name, frame, positions):
+        '''
+        Adds a morph target, unless it is all zero or its vertex count
+        differs from the basis
+        '''
+        if len(positions) != len(self.basis):
+            print("    Skipping morph target %s: topology changed" % (name))
+            return
+        deltas = positions - self.basis
+        if not len(deltas) or numpy.abs(deltas).max() <= MORPH_TOLERANCE:
+            return
+        self.targets.append((name, frame, deltas))
+
+    def sample_shapes(self):
+        '''
+        Samples the basis shape, and adds a morph target per shape key
+        '''
+        mesh_object = self.mesh_object
+        with basis_shape(mesh_object):
+            self.basis = self.sample(shape_key_index=0)
+        if not has_shape_keys(mesh_object):
+            return
+        key_blocks = mesh_object.data.shape_keys.key_blocks
+        for shape_key_index in range(1, len(key_blocks)):
+            key_block = key_blocks[shape_key_index]
+            with basis_shape(mesh_object, shape_key_index):
+                positions = self.sample(shape_key_index)
+            self.add_target(key_block.name, None, positions)
+            if len(positions) == len(self.basis):
+                self.shape_key_deltas.append((key_block,
+                                              positions - self.basis))
+
+    def sample_frame(self, frame):
+        '''
+        Adds a morph target for the current frame of the scene
+        '''
+        if self.apply_modifiers:
+            positions = self.sample()
+        else:
+            # mix animated shape key values, without modifiers
+            positions = self.basis.copy()
+            for key_block, deltas in self.shape_key_deltas:
+                if not key_block.mute:
+                    positions += key_block.value * deltas
+        self.add_target("frame.%g" % (frame), frame, positions)
+
+    def free(self):
+        self.bm.free()
+        bpy.data.meshes.remove(self.mesh)
+
+
+def sample_morph_targets(mesh_objects,
+                         scene,
+                         global_matrix,
+                         apply_modifiers=True,
+                         sample_rate=1.0,
+                         ):
+    '''
+    Samples morph targets for mesh objects, relative to their basis shape:
+
+     - one target per shape key (except the basis)
+     - one target per sampled frame of deform animation, from frame_start
+       to frame_end, every sample_rate frames
+
+    The frame range is stepped once for all mesh objects, and every mesh
+    object with deform animation is sampled at each frame, since setting
+    the frame updates the whole scene.
+
+    Targets store per-vertex position deltas, in the vertex order of the
+    evaluated mesh. Targets that are all zero are skipped, and so are
+    targets whose vertex count differs from the basis.
+
+    returns: OrderedDict of mesh object -> list of (name, frame, deltas)
+             tuples. frame is None for shape keys, and deltas are float32
+             arrays shaped (verts, 3)
+    '''
+
+    samplers = OrderedDict()
+
+    try:
+
+        # shape keys
+        for mesh_object in mesh_objects:
+            sampler = samplers[mesh_object] = MorphSampler(
+                mesh_object, scene, global_matrix,
+                apply_modifiers=apply_modifiers)
+            sampler.sample_shapes()
+
+        # deform animation
+        animated = [sampler for sampler in samplers.values()
+                    if has_deform_animation(sampler.mesh_object,
+                                            apply_modifiers)]
+        if animated:
+            frame_current = scene.frame_current
+            try:
+                frame = float(scene.frame_start)
+                while frame <= scene.frame_end:
+                    scene.frame_set(int(frame), subframe=frame - int(frame))
+                    for sampler in animated:
+                        sampler.sample_frame(frame)
+                    frame += sample_rate
+            finally:
+                scene.frame_set(frame_current)
+
+    finally:
+
+        for sampler in samplers.values():
+            sampler.free()
+
+    return OrderedDict((mesh_object, sampler.targets)
+                       for mesh_object, sampler in samplers.items())
@@ -1,198 +1,565 @@
 import bpy
+import hashlib
 import math
+import numpy
+import os
 import time
 import uuid
-from collections import OrderedDict
+from collections import OrderedDict, Counter
 from mathutils import Matrix
+from . import batch
+from . import binary
+from . import bvh
+from . import cache
 from . import geometry
+from . import lod
+from . import morph
+from . import build
 from . import three
-from . import json
+from . import timing
+from . import writer
 
 
-global_geometries = []
+global_writer = None
+
+global_geometry_cache = {}
+
+global_morph_targets = {}
 
 global_materials = {}
 
+global_material_fingerprints = None
+
+global_uuid_namespace = None
+
+global_uuids = set()
+
+global_totals = Counter()
+
+global_object_stats = []
+
+global_timings = timing.Timings()
+
+global_binary_writer = None
+
+global_bvh_writer = None
+
+global_build_options = {}
+
+global_geometry_queue = None
+
+global_disk_cache = None
+
+global_batcher = None
+
+global_cache_options = ()
+
 global_scale_matrix = Matrix.Identity(4)
 
 global_rotation_matrix = Matrix.Rotation(-math.pi / 2, 4, "X")
 
 
-def save_geometry(bm,
-                  geometry_name,
-                  export_normals=True,
-                  export_uvs=True,
-                  export_colors=True,
-                  export_index=True,
-                  ):
+def create_uuid(kind, name, digest=None):
+    '''
+    Creates a random uuid, or in deterministic mode a uuid derived from
+    the kind and name of the exported item, and an optional content
+    digest. Derived uuids are made unique within the export, so items
+    with equal names and content still get distinct uuids.
+    '''
+    if global_uuid_namespace is None:
+        return uuid.uuid4()
+    key = "%s/%s/%s" % (kind, name, digest or "")
+    item_uuid = uuid.uuid5(global_uuid_namespace, key)
+    count = 0
+    while item_uuid in global_uuids:
+        count += 1
+        item_uuid = uuid.uuid5(global_uuid_namespace, "%s#%d" % (key, count))
+    global_uuids.add(item_uuid)
+    return item_uuid
+
+
+def attributes_digest(attributes):
     '''
-    Saves bmesh data as BufferGeometry in the global geomtries list
+    returns: hex digest of vertex attribute arrays, or None when not in
+             deterministic mode
     '''
+    if global_uuid_namespace is None:
+        return None
+    digest = hashlib.sha1()
+    for name, array in attributes.items():
+        digest.update(name.encode("utf8"))
+        digest.update(numpy.ascontiguousarray(array))
+    return digest.hexdigest()
 
-    print("    Creating THREE.BufferGeometry: %s ..." % (geometry_name))
 
-    # get uv layer
-    if export_uvs:
-        uv_layer = bm.loops.layers.uv.active
-        export_uvs = export_uvs and uv_layer
-
-    # get color layer
-    if export_colors:
-        color_layer = bm.loops.layers.color.active
-        export_colors = export_colors and color_layer
-
-    # create vertex data->index map
-    if export_index:
-        vertex_map = {}
-
-    # vertex attribute arrays
-    positions = []
-    normals = []
-    uvs = []
-    colors = []
-    indices = []
-
-    # process each face loop to populate the vertex attribute arrays
-    for face in bm.faces:
-        for loop in face.loops:
-
-            # get current vertex data
-            position = loop.vert.co.to_tuple()
-            normal = loop.vert.normal.to_tuple() if export_normals else None
-            uv = loop[uv_layer].uv.to_tuple() if export_uvs else None
-            color = None
-            if export_colors:
-                color = loop[color_layer]
-                color = (color.r, color.g, color.b)
-
-            if export_index:
-
-                # Indexed BufferGeometry
-
-                # check vertex map for matching vertex data
-                vertex_key = hash((position, normal, uv, color))
-                if vertex_key in vertex_map:
-
-                    # get index of existing vertex key
-                    vertex_index = vertex_map[vertex_key]
-
-                else:
-
-                    # get new vertex data index
-                    vertex_index = len(vertex_map)
-                    vertex_map[vertex_key] = vertex_index
-
-                    # append vertex attribute data
-                    positions += position
-                    if export_normals:
-                        normals += normal
-                    if export_uvs:
-                        uvs += uv
-                    if export_colors:
-                        colors += color
-
-                # append vertex index attribute data
-                indices.append(vertex_index)
+def material_digest(material):
+    '''
+    returns: fingerprint of material properties, or None when not in
+             deterministic mode
+    '''
+    if global_uuid_namespace is None:
+        return None
+    return repr(three.material_fingerprint(material))
 
-            else:
 
-                # Non-indexed BufferGeometry
+def write_geometry(tag, stats, geometry, text):
+    '''
+    Writes a built BufferGeometry to the output file.
 
-                # append vertex attribute data
-                positions += position
-                if export_normals:
-                    normals += normal
-                if export_uvs:
-                    uvs += uv
-                if export_colors:
-                    colors += color
+    tag is an (object_stats, cache_tag) tuple. cache_tag is None, or a
+    (cache_entry, material_name, geometry_uuid) tuple for geometries that
+    are added to the disk cache.
+    '''
 
-    # create BufferGeomtry
-    geometry = three.create_buffergeometry(geometry_name,
-                                           positions,
-                                           normals,
-                                           uvs,
-                                           colors,
-                                           indices
-                                           )
+    object_stats, cache_tag = tag
 
-    # store in global geom list
-    global_geometries.append(geometry)
+    # update export totals
+    global_totals["total_positions"] += stats["vertices"]
+    global_totals["total_normals"] += stats["normals"]
+    global_totals["total_faces"] += stats["faces"]
 
-    return geometry["uuid"]
+    # vertex cache optimization report
+    if "acmr" in stats:
+        print("    Optimized THREE.BufferGeometry: %s "
+              "(ACMR %.3f -> %.3f, ATVR %.3f -> %.3f)" %
+              (stats["name"],
+               stats["acmr"], stats["optimized_acmr"],
+               stats["atvr"], stats["optimized_atvr"]))
 
+    # add to the disk cache, before the geometry is modified
+    if cache_tag is not None:
+        cache_entry, material_name, geometry_uuid = cache_tag
+        cache_entry.add(material_name, geometry_uuid, (stats, geometry, text))
+        if cache_entry.is_complete():
+            global_disk_cache.store(cache_entry)
 
-def save_mesh_object(mesh_object,
-                     parent_object,
-                     scene,
-                     apply_modifiers=True,
-                     split_by_material=True,
-                     export_normals=True,
-                     export_uvs=True,
-                     export_colors=True,
-                     export_index=True,
-                     morph_animation=True,
-                     sample_rate=True,
-                     ):
+    with stats["timings"].phase("write"):
+
+        if text is not None:
+
+            # already encoded by the geometry queue
+            global_writer.write_encoded(text)
+
+        else:
+
+            # move attribute arrays to the binary file
+            if global_binary_writer:
+                binary.store_attributes(global_binary_writer, geometry)
+
+            # move BVH node arrays to the BVH file
+            if global_bvh_writer:
+                bvh.store_bvh(global_bvh_writer, geometry)
+
+            # write to the output file
+            global_writer.write_geometry(geometry)
+
+    # add to the object stats
+    object_stats["vertices"] += stats["vertices"]
+    object_stats["faces"] += stats["faces"]
+    object_stats["geometries"].append(stats)
+
+
+def save_geometry(attributes,
+                  geometry_name,
+                  geometry_uuid,
+                  export_index=True,
+                  morph_targets=None,
+                  tag=None,
+                  ):
+    '''
+    Saves per-loop vertex attribute arrays as BufferGeometry to the output
+    file.
+
+    Vertex attributes are extracted by geometry.map_mesh_object, since bpy
+    is only usable from the main thread. Welding, quantization and encoding
+    are queued on the global geometry queue, which may run them in worker
+    processes.
     '''
-    Saves a mesh object
+
+    print("    Creating THREE.BufferGeometry: %s ..." % (geometry_name))
+
+    # queue BufferGeometry
+    global_geometry_queue.submit(geometry_name,
+                                 geometry_uuid,
+                                 attributes,
+                                 export_index=export_index,
+                                 morph_targets=morph_targets,
+                                 encode=not (global_binary_writer or
+                                             global_bvh_writer),
+                                 indent=global_writer.indent,
+                                 float_precision=global_writer.float_precision,
+                                 tag=tag,
+                                 **global_build_options
+                                 )
+
+
+def save_mesh_geometries(mesh_object,
+                         scene,
+                         apply_modifiers=True,
+                         split_by_material=True,
+                         export_normals=True,
+                         export_uvs=True,
+                         export_colors=True,
+                         export_index=True,
+                         morph_animation=False,
+                         sample_rate=1.0,
+                         fingerprint=None,
+                         object_stats=None,
+                         lod_level=0,
+                         ):
     '''
+    Saves the geometries of a mesh object.
 
-    def update_material(material):
-        '''
-        '''
-        if not material:
-            material_uuid = None
-        elif material in global_materials:
-            material_uuid = global_materials[material]
-        else:
-            material_uuid = uuid.uuid4()
-            global_materials[material] = material_uuid
-        return material_uuid
+    The geometries are added to the disk cache if a fingerprint is given.
+    Phase timings and counts are added to object_stats. Geometries of
+    decimated levels of detail are named after their lod_level.
 
-    print("  Exporting MESH: %s (%s) ..." %
-          (mesh_object.name, mesh_object.data.name))
+    returns: list of (material, geometry_uuid) tuples
+    '''
 
-    # map mesh materials -> geometries
-    mesh_map = geometry.map_mesh_object(mesh_object,
+    global_matrix = global_rotation_matrix * global_scale_matrix
+
+    def map_mesh_object(vertex_index=False):
+        return geometry.map_mesh_object(mesh_object,
                                         scene,
-                                        global_rotation_matrix *
-                                        global_scale_matrix,
+                                        global_matrix,
                                         apply_modifiers=apply_modifiers,
                                         split_by_material=split_by_material,
                                         export_normals=export_normals,
+                                        export_uvs=export_uvs,
+                                        export_colors=export_colors,
+                                        export_vertex_index=vertex_index,
+                                        timings=object_stats["timings"],
                                         )
 
-    num_geometries = len(mesh_map)
+    morph_targets = None
+
+    if morph_animation and \
+            morph.has_morph_targets(mesh_object, apply_modifiers):
+
+        # map mesh materials -> geometries. The geometries are exported
+        # in their basis shape, since morph targets are relative to it.
+        with morph.basis_shape(mesh_object):
+            mesh_map = map_mesh_object(vertex_index=True)
+
+        # shape keys and deform animation are usually sampled for all
+        # mesh objects at once, by sample_morph_objects
+        with object_stats["timings"].phase("morph"):
+            morph_targets = global_morph_targets.pop(mesh_object, None)
+            if morph_targets is None:
+                morph_targets = morph.sample_morph_targets(
+                    [mesh_object],
+                    scene,
+                    global_matrix,
+                    apply_modifiers=apply_modifiers,
+                    sample_rate=sample_rate,
+                    )[mesh_object]
+        print("    Sampled %d morph targets ..." % (len(morph_targets)))
+
+    else:
+
+        # map mesh materials -> geometries
+        mesh_map = map_mesh_object()
+
+    single_geometry = len(mesh_map) == 1
+
+    mesh_name = mesh_object.data.name
+    if lod_level:
+        mesh_name = "%s.lod%d" % (mesh_name, lod_level)
+
+    cache_entry = None
+    if fingerprint:
+        cache_entry = cache.CacheEntry(fingerprint, len(mesh_map))
+
+    result = []
+
+    # process each geometry
+    for material, attributes in mesh_map.items():
+
+        # save vertex attributes as BufferGeometry
+        material_name = material.name if material else None
+        if single_geometry:
+            geometry_name = mesh_name
+        else:
+            geometry_name = "%s.%s" % (mesh_name, material_name)
+        geometry_uuid = create_uuid("geometry",
+                                    geometry_name,
+                                    attributes_digest(attributes))
+        cache_tag = None
+        if cache_entry:
+            cache_tag = (cache_entry, material_name, geometry_uuid)
+        save_geometry(attributes,
+                      geometry_name,
+                      geometry_uuid,
+                      export_index=export_index,
+                      morph_targets=morph_targets,
+                      tag=(object_stats, cache_tag),
+                      )
+
+        result.append((material, geometry_uuid))
+
+    return result
+
+
+def sample_morph_objects(mesh_objects,
+                         scene,
+                         apply_modifiers=True,
+                         sample_rate=1.0,
+                         ):
+    '''
+    Samples the morph targets of all mesh objects that have them into the
+    global morph targets map, so the frame range is stepped only once.
+
+    Linked duplicates reuse the geometry of the first mesh object, so only
+    that mesh object is sampled.
+    '''
+
+    global_morph_targets.clear()
+
+    morph_objects = OrderedDict()
+    for mesh_object in mesh_objects:
+        if mesh_object.type != "MESH" or \
+                not morph.has_morph_targets(mesh_object, apply_modifiers):
+            continue
+        key = (mesh_object.data,
+               geometry.modifier_signature(mesh_object, apply_modifiers))
+        morph_objects.setdefault(key, mesh_object)
+
+    if not morph_objects:
+        return
+
+    print("  Sampling morph targets of %d objects ..." %
+          (len(morph_objects)))
+
+    with global_timings.phase("morph"):
+        global_morph_targets.update(morph.sample_morph_targets(
+            list(morph_objects.values()),
+            scene,
+            global_rotation_matrix * global_scale_matrix,
+            apply_modifiers=apply_modifiers,
+            sample_rate=sample_rate,
+            ))
+
+
+def load_cached_geometries(fingerprint, object_stats):
+    '''
+    Queues the disk cached geometries of a mesh fingerprint for writing.
+
+    returns: list of (material, geometry_uuid) tuples, or None
+    '''
+
+    cache_entry = global_disk_cache.load(fingerprint)
+    if cache_entry is None:
+        return None
+
+    result = []
+    for material_name, geometry_uuid, built in cache_entry.results():
+        material = None
+        if material_name is not None:
+            material = bpy.data.materials[material_name]
+
+        # cached geometries were built by an earlier export, so their
+        # build timings do not apply
+        stats, geometry, text = built
+        stats = OrderedDict(stats)
+        stats["timings"] = timing.Timings()
+        stats["cached"] = True
+        global_uuids.add(geometry_uuid)
+        global_geometry_queue.submit_result((stats, geometry, text),
+                                            tag=(object_stats, None))
+        result.append((material, geometry_uuid))
+
+    return result
+
+
+def create_object_stats(object_name, mesh_name=None):
+    '''
+    Creates the export stats of an exported object, and adds them to the
+    global object stats.
+    '''
+    object_stats = OrderedDict()
+    object_stats["name"] = object_name
+    object_stats["mesh"] = mesh_name
+    object_stats["timings"] = timing.Timings()
+    object_stats["vertices"] = 0
+    object_stats["faces"] = 0
+    object_stats["reused"] = False
+    object_stats["geometries"] = []
+    global_object_stats.append(object_stats)
+    return object_stats
+
+
+def merged_material(material):
+    '''
+    Returns the first exported material with the same fingerprint as
+    material, when materials are merged. Otherwise returns material.
+    '''
+    if not material or global_material_fingerprints is None:
+        return material
+    fingerprint = three.material_fingerprint(material)
+    return global_material_fingerprints.setdefault(fingerprint, material)
+
+
+def update_material(material):
+    '''
+    Adds a material to the global materials map. When materials are
+    merged, materials with equal fingerprints share a single uuid.
+
+    returns: material uuid, or None
+    '''
+    if not material:
+        material_uuid = None
+    elif material in global_materials:
+        material_uuid = global_materials[material]
+    else:
+        merged = merged_material(material)
+        if merged in global_materials:
+            material_uuid = global_materials[merged]
+        else:
+            material_uuid = create_uuid("material",
+                                        merged.name,
+                                        material_digest(merged))
+            global_materials[merged] = material_uuid
+        global_materials[material] = material_uuid
+    return material_uuid
+
+
+def get_mesh_geometries(mesh_object,
+                        scene,
+                        object_stats,
+                        apply_modifiers=True,
+                        split_by_material=True,
+                        export_normals=True,
+                        export_uvs=True,
+                        export_colors=True,
+                        export_index=True,
+                        morph_animation=True,
+                        sample_rate=1.0,
+                        lod_level=0,
+                        lod_ratio=None,
+                        ):
+    '''
+    Returns the geometries of a mesh object, saving them if they are not
+    saved already.
+
+    lod_level and lod_ratio identify a decimated level of detail, which is
+    saved with the current (decimated) modifier stack.
 
-    if num_geometries == 1:
+    returns: list of (material, geometry_uuid) tuples
+    '''
+
+    # Mesh objects that share a mesh datablock and modifier stack (linked
+    # duplicates) produce identical geometries, so they are only saved once
+    # and referenced by every mesh object that uses them.
+    cache_key = (mesh_object.data,
+                 geometry.modifier_signature(mesh_object, apply_modifiers),
+                 apply_modifiers,
+                 split_by_material,
+                 export_normals,
+                 export_uvs,
+                 export_colors,
+                 export_index,
+                 morph_animation,
+                 sample_rate,
+                 lod_ratio,
+                 )
+
+    if cache_key in global_geometry_cache:
+
+        print("    Reusing THREE.BufferGeometry: %s ..." %
+              (mesh_object.data.name))
+        object_stats["reused"] = True
+        return global_geometry_cache[cache_key]
+
+    # Geometries are also found by content fingerprint in the disk
+    # cache, so unchanged meshes are not triangulated or encoded again.
+    # Morph targets depend on animation, so they are never cached.
+    fingerprint = None
+    geometry_list = None
+    if global_disk_cache and not (
+            morph_animation and
+            morph.has_morph_targets(mesh_object, apply_modifiers)):
+        with object_stats["timings"].phase("fingerprint"):
+            fingerprint = geometry.mesh_fingerprint(
+                mesh_object,
+                scene,
+                apply_modifiers=apply_modifiers,
+                options=global_cache_options + cache_key[2:],
+                )
+
+    if fingerprint in global_geometry_cache:
+        print("    Reusing THREE.BufferGeometry: %s ..." %
+              (mesh_object.data.name))
+        geometry_list = global_geometry_cache[fingerprint]
+        object_stats["reused"] = True
+    elif fingerprint:
+        geometry_list = load_cached_geometries(fingerprint,
+                                               object_stats)
+        if geometry_list is not None:
+            print("    Reusing cached THREE.BufferGeometry: %s ..." %
+                  (mesh_object.data.name))
+
+    if geometry_list is None:
+        geometry_list = save_mesh_geometries(
+            mesh_object,
+            scene,
+            apply_modifiers=apply_modifiers,
+            split_by_material=split_by_material,
+            export_normals=export_normals,
+            export_uvs=export_uvs,
+            export_colors=export_colors,
+            export_index=export_index,
+            morph_animation=morph_animation,
+            sample_rate=sample_rate,
+            fingerprint=fingerprint,
+            object_stats=object_stats,
+            lod_level=lod_level,
+            )
+
+    global_geometry_cache[cache_key] = geometry_list
+    if fingerprint:
+        global_geometry_cache[fingerprint] = geometry_list
+
+    return geometry_list
+
+
+def create_mesh_object(object_name,
+                       geometry_list,
+                       matrix=Matrix.Identity(4),
+                       instance_matrices=None,
+                       ):
+    '''
+    Creates a THREE.Mesh for a single geometry, or a THREE.Object3D with a
+    child THREE.Mesh for each geometry.
+
+    When instance_matrices is given, THREE.InstancedMesh objects are
+    created instead of THREE.Mesh objects.
+    '''
+
+    def create_mesh(mesh_name, **kwargs):
+        if instance_matrices is None:
+            return three.create_mesh(mesh_name, **kwargs)
+        return three.create_instanced_mesh(mesh_name,
+                                           instance_matrices,
+                                           **kwargs)
+
+    if len(geometry_list) == 1:
 
         # This mesh maps to a single geometry, so it gets saved
         # as a single THREE.Mesh, and single THREE.BufferGeometry
 
-        # save bmesh data into global buffergeometries list
-        material, bm = mesh_map.popitem()
-        geometry_name = mesh_object.data.name
-        geometry_uuid = save_geometry(bm,
-                                      geometry_name,
-                                      export_normals=export_normals,
-                                      export_uvs=export_uvs,
-                                      export_colors=export_colors,
-                                      export_index=export_index,
-                                      )
-
-        # finished with temp mesh data
-        bm.free()
+        material, geometry_uuid = geometry_list[0]
 
         # update global materials map
         material_uuid = update_material(material)
 
         # create mesh object
-        object = three.create_mesh(mesh_object.name,
-                                   matrix=mesh_object.matrix_local,
-                                   geometry_uuid=geometry_uuid,
-                                   material_uuid=material_uuid
-                                   )
+        object = create_mesh(object_name,
+                             matrix=matrix,
+                             geometry_uuid=geometry_uuid,
+                             material_uuid=material_uuid,
+                             object_uuid=create_uuid("object", object_name)
+                             )
 
     else:
 
@@ -201,44 +568,289 @@ def save_mesh_object(mesh_object,
         # THREE.BufferGeometry for each geometry.
 
         # create Object3D
-        object = three.create_object3d(mesh_object.name,
-                                       matrix=mesh_object.matrix_local)
+        object = three.create_object3d(
+            object_name,
+            matrix=matrix,
+            object_uuid=create_uuid("object", object_name))
         object_children = object["children"]
 
         # process each geometry
-        for material, bm in mesh_map.items():
-
-            # save bmesh data into global buffergeometries list
-            material_name = material.name if material else None
-            geometry_name = "%s.%s" % (mesh_object.data.name, material_name)
-            geometry_uuid = save_geometry(bm,
-                                          geometry_name,
-                                          export_normals=export_normals,
-                                          export_uvs=export_uvs,
-                                          export_colors=export_colors,
-                                          export_index=export_index,
-                                          )
-
-            # no longer need the bmesh data
-            bm.free()
+        for material, geometry_uuid in geometry_list:
 
             # update global materials map
             material_uuid = update_material(material)
 
             # create child mesh object
-            child_name = "%s.%s" % (mesh_object.name, material_name)
-            child_mesh = three.create_mesh(child_name,
-                                           geometry_uuid=geometry_uuid,
-                                           material_uuid=material_uuid
-                                           )
+            material_name = material.name if material else None
+            child_name = "%s.%s" % (object_name, material_name)
+            child_mesh = create_mesh(child_name,
+                                     geometry_uuid=geometry_uuid,
+                                     material_uuid=material_uuid,
+                                     object_uuid=create_uuid("object",
+                                                             child_name)
+                                     )
             object_children.append(child_mesh)
 
+    return object
+
+
+def save_mesh_object(mesh_object,
+                     parent_object,
+                     scene,
+                     apply_modifiers=True,
+                     split_by_material=True,
+                     export_normals=True,
+                     export_uvs=True,
+                     export_colors=True,
+                     export_index=True,
+                     morph_animation=True,
+                     sample_rate=1.0,
+                     lod_levels=0,
+                     lod_ratio=0.5,
+                     lod_distance=10.0,
+                     ):
+    '''
+    Saves a mesh object.
+
+    When lod_levels is set, the mesh object is saved as a THREE.LOD with
+    the full resolution mesh and lod_levels decimated levels. Each level
+    keeps lod_ratio of the triangles of the previous level, and is shown
+    from lod_distance further away.
+    '''
+
+    print("  Exporting MESH: %s (%s) ..." %
+          (mesh_object.name, mesh_object.data.name))
+
+    object_stats = create_object_stats(mesh_object.name,
+                                       mesh_object.data.name)
+
+    options = {
+        "apply_modifiers": apply_modifiers,
+        "split_by_material": split_by_material,
+        "export_normals": export_normals,
+        "export_uvs": export_uvs,
+        "export_colors": export_colors,
+        "export_index": export_index,
+        "morph_animation": morph_animation,
+        "sample_rate": sample_rate,
+    }
+
+    # full resolution geometries
+    geometry_list = get_mesh_geometries(mesh_object,
+                                        scene,
+                                        object_stats,
+                                        **options)
+
+    # morph targets are only exported at full resolution, so meshes with
+    # morph targets get no levels of detail
+    if lod_levels and not (
+            morph_animation and
+            morph.has_morph_targets(mesh_object, apply_modifiers)):
+
+        # create LOD, with the full resolution mesh as its first level
+        object = three.create_lod(
+            mesh_object.name,
+            matrix=mesh_object.matrix_local,
+            object_uuid=create_uuid("lod", mesh_object.name))
+        three.add_lod_level(object,
+                            create_mesh_object(mesh_object.name,
+                                               geometry_list),
+                            distance=0.0)
+
+        # decimated levels
+        for level, ratio in enumerate(lod.level_ratios(lod_levels,
+                                                       lod_ratio), 1):
+
+            print("    Decimating LOD level %d (ratio %.4g) ..." %
+                  (level, ratio))
+            with lod.decimated(mesh_object, ratio, apply_modifiers):
+                level_geometry_list = get_mesh_geometries(
+                    mesh_object,
+                    scene,
+                    object_stats,
+                    lod_level=level,
+                    lod_ratio=ratio,
+                    **dict(options, apply_modifiers=True))
+
+            level_name = "%s.lod%d" % (mesh_object.name, level)
+            three.add_lod_level(object,
+                                create_mesh_object(level_name,
+                                                   level_geometry_list),
+                                distance=level * lod_distance)
+
+    else:
+
+        object = create_mesh_object(mesh_object.name,
+                                    geometry_list,
+                                    matrix=mesh_object.matrix_local)
+
     # append to the parent object
     parent_object["children"].append(object)
 
     return object["uuid"]
 
 
+def find_instance_groups(mesh_objects,
+                         apply_modifiers=True,
+                         min_count=2,
+                         morph_animation=True,
+                         ):
+    '''
+    Groups static mesh objects that share a mesh datablock and modifier
+    stack, and so export identical geometries.
+
+    returns: list of mesh object lists, with at least min_count objects
+    '''
+
+    groups = OrderedDict()
+    for mesh_object in mesh_objects:
+        if mesh_object.type != "MESH" or \
+                not is_static_object(mesh_object,
+                                     apply_modifiers,
+                                     morph_animation):
+            continue
+        key = (mesh_object.data,
+               geometry.modifier_signature(mesh_object, apply_modifiers))
+        groups.setdefault(key, []).append(mesh_object)
+
+    return [group for group in groups.values() if len(group) >= min_count]
+
+
+def save_instanced_objects(mesh_objects,
+                           parent_object,
+                           scene,
+                           max_count=1024,
+                           **options
+                           ):
+    '''
+    Saves mesh objects that share a mesh datablock as THREE.InstancedMesh
+    objects, with at most max_count instances each. The geometries are
+    saved once, and each instance matrix is the local matrix of a mesh
+    object.
+
+    options are the save_mesh_object geometry options.
+    '''
+
+    mesh_name = mesh_objects[0].data.name
+
+    print("  Instancing MESH: %s (%d instances) ..." %
+          (mesh_name, len(mesh_objects)))
+
+    object_stats = create_object_stats("%s.instances" % (mesh_name),
+                                       mesh_name)
+
+    geometry_list = get_mesh_geometries(mesh_objects[0],
+                                        scene,
+                                        object_stats,
+                                        **options)
+
+    for start in range(0, len(mesh_objects), max_count):
+
+        # pack instance matrices, in the same element order as the
+        # matrix of a THREE.Mesh
+        instances = mesh_objects[start:start + max_count]
+        instance_matrices = numpy.array(
+            [[value for row in o.matrix_local for value in row]
+             for o in instances],
+            dtype=numpy.float32)
+
+        object_name = "%s.instances.%d" % (mesh_name, start // max_count)
+        object = create_mesh_object(object_name,
+                                    geometry_list,
+                                    instance_matrices=instance_matrices)
+        parent_object["children"].append(object)
+
+
+def is_static_object(mesh_object, apply_modifiers=True,
+                     morph_animation=True):
+    '''
+    Returns True if a mesh object and its parents are not animated, and
+    no morph targets are exported for it, so it can be merged into a
+    static batch.
+    '''
+    if morph_animation and \
+            morph.has_morph_targets(mesh_object, apply_modifiers):
+        return False
+    return not morph.is_animated(mesh_object)
+
+
+def batch_mesh_object(mesh_object,
+                      scene,
+                      apply_modifiers=True,
+                      split_by_material=True,
+                      export_normals=True,
+                      export_uvs=True,
+                      export_colors=True,
+                      ):
+    '''
+    Adds the geometry of a static mesh object to the global static
+    batcher, with its world transform applied.
+    '''
+
+    print("  Batching MESH: %s (%s) ..." %
+          (mesh_object.name, mesh_object.data.name))
+
+    object_stats = create_object_stats(mesh_object.name,
+                                       mesh_object.data.name)
+
+    global_matrix = global_rotation_matrix * global_scale_matrix * \
+        mesh_object.matrix_world
+
+    mesh_map = geometry.map_mesh_object(mesh_object,
+                                        scene,
+                                        global_matrix,
+                                        apply_modifiers=apply_modifiers,
+                                        split_by_material=split_by_material,
+                                        export_normals=export_normals,
+                                        export_uvs=export_uvs,
+                                        export_colors=export_colors,
+                                        timings=object_stats["timings"],
+                                        )
+
+    with object_stats["timings"].phase("batch"):
+        for material, attributes in mesh_map.items():
+            global_batcher.add(merged_material(material), attributes)
+
+
+def create_report(filepath, export_time):
+    '''
+    Creates an export report with per-object and per-phase timings, peak
+    memory use and counts.
+
+    returns: OrderedDict
+    '''
+
+    phases = timing.Timings(global_timings)
+    objects = []
+
+    for object_stats in global_object_stats:
+
+        # object time includes the time spent building its geometries,
+        # even if they were built in worker processes
+        object_timings = timing.Timings(object_stats["timings"])
+        for geometry_stats in object_stats["geometries"]:
+            object_timings.update_totals(geometry_stats["timings"])
+        phases.update_totals(object_timings)
+
+        object_report = OrderedDict(object_stats)
+        object_report["time"] = object_timings.total()
+        object_report["timings"] = OrderedDict(
+            timing.sorted_phases(object_timings))
+        objects.append(object_report)
+
+    report = OrderedDict()
+    report["file"] = filepath
+    report["time"] = export_time
+    report["phases"] = OrderedDict(timing.sorted_phases(phases))
+    report["peak_memory"] = timing.peak_memory()
+    report["peak_worker_memory"] = timing.peak_memory(children=True)
+    report["total_vertices"] = global_totals["total_positions"]
+    report["total_faces"] = global_totals["total_faces"]
+    report["objects"] = objects
+
+    return report
+
+
 def save(operator,
          context,
          filepath=None,
@@ -254,6 +866,26 @@ def save(operator,
          sample_rate=1,
          morph_animation_in_userdata=True,
          float_precision=6,
+         binary_attributes=False,
+         quantize_attributes=False,
+         quantize_positions=False,
+         quantize_tolerance=0.005,
+         processes=1,
+         export_cache=False,
+         optimize_vertex_cache=False,
+         export_stats=False,
+         lod_levels=0,
+         lod_ratio=0.5,
+         lod_distance=10.0,
+         static_batching=False,
+         batch_max_vertices=batch.BATCH_MAX_VERTICES,
+         batch_cell_size=0.0,
+         instancing=False,
+         instance_min_count=2,
+         instance_max_count=1024,
+         build_bvh=False,
+         merge_materials=False,
+         deterministic=False,
          ):
     '''
     Saves scene objects to a Three.js Object Format 4.3 JSON file
@@ -264,11 +896,126 @@ def save(operator,
 
     start = time.time()
 
-    # reset global geometries list
-    global_geometries.clear()
+    # reset global geometry cache
+    global_geometry_cache.clear()
+    global_morph_targets.clear()
 
     # reset global unique materials map
     global_materials.clear()
+    global global_material_fingerprints
+    global_material_fingerprints = {} if merge_materials else None
+
+    # set uuid mode. Deterministic uuids are derived from the output file
+    # name, so separate files do not share uuids.
+    global global_uuid_namespace
+    global_uuid_namespace = None
+    global_uuids.clear()
+    if deterministic:
+        global_uuid_namespace = uuid.uuid5(uuid.NAMESPACE_URL,
+                                           os.path.basename(filepath))
+
+    # reset global export totals
+    global_totals.clear()
+
+    # reset global export stats
+    global_object_stats.clear()
+    global_timings.clear()
+
+    # set geometry build options
+    global global_build_options
+    global_build_options = {
+        "optimize_vertex_cache": optimize_vertex_cache,
+        "quantize_options": None,
+        "morph_in_userdata": morph_animation_in_userdata,
+        "build_bvh": build_bvh,
+    }
+    if build_bvh and optimize_vertex_cache:
+        print("Warning: Build BVH orders triangles by BVH leaf, so Optimize "
+              "Vertex Cache only reorders vertices")
+    if quantize_attributes:
+        global_build_options["quantize_options"] = {
+            "quantize_positions": quantize_positions,
+            "tolerance": quantize_tolerance,
+        }
+
+    # open disk cache
+    global global_disk_cache, global_cache_options
+    global_disk_cache = None
+    if export_cache:
+        global_disk_cache = cache.GeometryCache(
+            binary.sidecar_filepath(filepath, ".cache"))
+        global_cache_options = (cache.CACHE_VERSION,
+                                global_scale,
+                                float_precision,
+                                binary_attributes,
+                                deterministic,
+                                repr(sorted(global_build_options.items())),
+                                )
+
+    # open binary attributes file
+    global global_binary_writer
+    global_binary_writer = None
+    if binary_attributes:
+        binary_filepath = binary.sidecar_filepath(filepath)
+        print("Writing %s ..." % (binary_filepath))
+        global_binary_writer = binary.BinaryWriter(binary_filepath)
+
+    # open BVH file
+    global global_bvh_writer
+    global_bvh_writer = None
+    if build_bvh:
+        bvh_filepath = binary.sidecar_filepath(filepath, ".bvh")
+        print("Writing %s ..." % (bvh_filepath))
+        global_bvh_writer = binary.BinaryWriter(bvh_filepath)
+
+    # open output file. Geometries are written to the file as soon as
+    # they are saved, so they are not all held in memory at once.
+    global global_writer
+    print("Writing %s ..." % (filepath))
+    global_writer = writer.StreamWriter(filepath,
+                                        float_precision=float_precision)
+
+    # create geometry queue. Geometries are built and encoded in worker
+    # processes, and written to the output file in submission order.
+    global global_geometry_queue
+    global_geometry_queue = build.GeometryQueue(write_geometry,
+                                                processes=processes)
+
+    # create static batcher. Batches are saved as THREE.Mesh children of
+    # the root object, in world space.
+    def save_batch(material, attributes):
+        material_name = material.name if material else None
+        batch_name = "batch.%s.%d" % (material_name,
+                                      len(root_object["children"]))
+        print("  Saving batch: %s ..." % (batch_name))
+        batch_stats = create_object_stats(batch_name)
+        geometry_uuid = create_uuid("geometry",
+                                    batch_name,
+                                    attributes_digest(attributes))
+        save_geometry(attributes,
+                      batch_name,
+                      geometry_uuid,
+                      export_index=export_index,
+                      tag=(batch_stats, None),
+                      )
+        root_object["children"].append(
+            three.create_mesh(batch_name,
+                              geometry_uuid=geometry_uuid,
+                              material_uuid=update_material(material),
+                              object_uuid=create_uuid("object", batch_name)))
+
+    # Levels of detail take precedence over static batching, since batched
+    # meshes cannot have levels of detail.
+    global global_batcher
+    global_batcher = None
+    if static_batching and lod_levels:
+        print("Static batching is disabled by LOD levels")
+    elif static_batching:
+        global_batcher = batch.StaticBatcher(
+            save_batch,
+            max_vertices=batch_max_vertices,
+            cell_size=batch_cell_size * global_scale,
+            )
 
     # set  scale global matrix
     global global_scale_matrix
@@ -289,14 +1036,70 @@ def save(operator,
         if not selected_only:
             bpy.ops.object.select_all(action="SELECT")
 
+        # objects to export. Deterministic exports save objects in name
+        # order, since the selection order is not stable.
+        selected_objects = context.selected_objects[:]
+        if deterministic:
+            selected_objects.sort(key=lambda o: o.name)
+
+        # sample morph targets
+        if morph_animation:
+            sample_morph_objects(selected_objects,
+                                 scene,
+                                 apply_modifiers=apply_modifiers,
+                                 sample_rate=sample_rate,
+                                 )
+
         # root object
-        root_object = three.create_object3d("root")
+        root_object = three.create_object3d(
+            "root", object_uuid=create_uuid("object", "root"))
+
+        # save groups of static mesh objects that share mesh data as
+        # instanced meshes
+        instanced_objects = set()
+        if instancing:
+            for group in find_instance_groups(selected_objects,
+                                              apply_modifiers,
+                                              instance_min_count,
+                                              morph_animation):
+                save_instanced_objects(group,
+                                       root_object,
+                                       scene,
+                                       max_count=instance_max_count,
+                                       apply_modifiers=apply_modifiers,
+                                       split_by_material=split_by_material,
+                                       export_normals=export_normals,
+                                       export_uvs=export_uvs,
+                                       export_colors=export_colors,
+                                       export_index=export_index,
+                                       morph_animation=morph_animation,
+                                       sample_rate=sample_rate,
+                                       )
+                instanced_objects.update(group)
 
         # parse the selected objects
-        for selected_object in context.selected_objects:
+        for selected_object in selected_objects:
+
+            # instanced mesh objects are already saved
+            if selected_object in instanced_objects:
+                continue
+
+            # merge static mesh object into a batch
+            if selected_object.type == "MESH" and global_batcher and \
+                    is_static_object(selected_object,
+                                     apply_modifiers,
+                                     morph_animation):
+                batch_mesh_object(selected_object,
+                                  scene,
+                                  apply_modifiers=apply_modifiers,
+                                  split_by_material=split_by_material,
+                                  export_normals=export_normals,
+                                  export_uvs=export_uvs,
+                                  export_colors=export_colors,
+                                  )
 
             # parse selected mesh object
-            if selected_object.type == "MESH":
+            elif selected_object.type == "MESH":
                 save_mesh_object(selected_object,
                                  root_object,
                                  scene,
@@ -305,15 +1108,42 @@ def save(operator,
                                  export_normals=export_normals,
                                  export_uvs=export_uvs,
                                  export_colors=export_colors,
-                                 export_index=export_index
+                                 export_index=export_index,
+                                 morph_animation=morph_animation,
+                                 sample_rate=sample_rate,
+                                 lod_levels=lod_levels,
+                                 lod_ratio=lod_ratio,
+                                 lod_distance=lod_distance * global_scale,
                                  )
 
             else:
                 print("  Skipping %s: %s ..." %
                       (selected_object.type, selected_object.name))
 
+        # save remaining batches
+        if global_batcher:
+            global_batcher.finish()
+            global_batcher = None
+
+        # write remaining queued geometries
+        global_geometry_queue.finish()
+
+    except:
+
+        # cancel queued geometries, and delete the incomplete output files
+        global_geometry_queue.close()
+        global_writer.close()
+        if global_binary_writer:
+            global_binary_writer.close()
+        if global_bvh_writer:
+            global_bvh_writer.close()
+        raise
+
     finally:
 
+        # release morph targets of mesh objects that were not saved
+        global_morph_targets.clear()
+
         # always restore initial object selection
         bpy.ops.object.select_all(action="DESELECT")
         for o in initial_selected_objects:
@@ -330,45 +1160,68 @@ def save(operator,
 
     # parse materials
     materials = output["materials"] = []
+    material_uuids = set()
     for material, material_uuid in global_materials.items():
+
+        # merged materials share a uuid, and are only written once
+        if material_uuid in material_uuids:
+            continue
+        material_uuids.add(material_uuid)
         materials.append(three.create_material(material, material_uuid))
 
-    # attach geometries
-    output["geometries"] = global_geometries
-
-    # calculate stats
-    total_positions = 0
-    total_normals = 0
-    total_faces = int(0)
-    for geometry in global_geometries:
-        attributes = geometry["data"]["attributes"]
-        total_positions += int(len(attributes["position"]["array"]) / 3)
-        if "normal" in attributes:
-            total_normals += int(len(attributes["normal"]["array"]) / 3)
-        if "index" in attributes:
-            total_faces += int(len(attributes["index"]["array"]) / 3)
-        else:
-            total_faces += int(len(attributes["position"]["array"]) / 3)
+    # attach stats
     metadata = output["metadata"]
-    metadata["total_positions"] = total_positions
-    metadata["total_normals"] = total_normals
-    metadata["total_faces"] = total_faces
-
-    # save JSON to file
-    print("\nWriting %s ... " % (filepath), end="")
-    file = open(filepath, "w+", encoding="utf8", newline="\n")
-    json.JSON_FLOAT_PRECISION = float_precision
-    json.json.dump(output, file, indent=4)
-    file.close()
-
-    # import pprint
-    # pprint.pprint(output)
+    metadata["total_positions"] = global_totals["total_positions"]
+    metadata["total_normals"] = global_totals["total_normals"]
+    metadata["total_faces"] = global_totals["total_faces"]
+
+    sidecar_writers = []
+
+    if global_binary_writer:
+        metadata["buffer"] = global_binary_writer.uri
+        sidecar_writers.append(global_binary_writer)
+        global_binary_writer = None
+
+    if global_bvh_writer:
+        metadata["bvh"] = global_bvh_writer.uri
+        sidecar_writers.append(global_bvh_writer)
+        global_bvh_writer = None
+
+    # write remaining values to file. The output files are written to
+    # temporary files, which replace the previous export only when they
+    # are complete.
+    print("\nFinishing %s ... " % (filepath), end="")
+    try:
+        with global_timings.phase("write"):
+            global_writer.finish(output)
+            for sidecar_writer in sidecar_writers:
+                sidecar_writer.finish()
+    except:
+        global_writer.close()
+        for sidecar_writer in sidecar_writers:
+            sidecar_writer.close()
+        raise
+    global_writer = None
+    global_geometry_queue = None
+
+    # remove disk cache entries of geometries that were not exported
+    if global_disk_cache:
+        global_disk_cache.prune()
+        global_disk_cache = None
 
     print("done.")
 
     # export has completed
     end = time.time()
 
+    # report timings
+    report = create_report(filepath, end - start)
+    timing.print_summary(report)
+    if export_stats:
+        stats_filepath = binary.sidecar_filepath(filepath, ".stats.json")
+        print("\nWriting %s ..." % (stats_filepath))
+        timing.write_report(stats_filepath, report)
+
     print("\nCompleted in %ds." % (end - start))
 
     return {'FINISHED'}
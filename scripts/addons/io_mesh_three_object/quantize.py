@@ -0,0 +1,147 @@
+import numpy
+from collections import OrderedDict
+
+
+# normalized typed array types -> (numpy dtype, maximum integer value)
+NORMALIZED_TYPES = {
+    "Int8Array": (numpy.int8, 127),
+    "Int16Array": (numpy.int16, 32767),
+    "Uint8Array": (numpy.uint8, 255),
+    "Uint16Array": (numpy.uint16, 65535),
+}
+
+# attribute name -> normalized types to try, narrowest first
+ATTRIBUTE_TYPES = {
+    "normal": ("Int8Array", "Int16Array"),
+    "uv": ("Uint16Array", ),
+    "color": ("Uint8Array", "Uint16Array"),
+}
+
+# bits used for quantized positions
+POSITION_BITS = 16
+
+
+def quantize_normalized(array, type):
+    '''
+    Converts floats to a normalized integer typed array type.
+
+    Values are clamped to [-1, 1] for signed types, and [0, 1] for
+    unsigned types.
+    '''
+    dtype, max_value = NORMALIZED_TYPES[type]
+    min_value = -max_value if numpy.dtype(dtype).kind == "i" else 0
+    array = numpy.rint(numpy.asarray(array, dtype=numpy.float64) * max_value)
+    return numpy.clip(array, min_value, max_value).astype(dtype)
+
+
+def dequantize_normalized(array, type):
+    '''
+    Converts a normalized integer array back to floats, the same way WebGL
+    reads normalized vertex attributes.
+    '''
+    dtype, max_value = NORMALIZED_TYPES[type]
+    return numpy.maximum(array / max_value, -1.0)
+
+
+def max_error(a, b):
+    '''
+    Returns the maximum absolute difference between two arrays
+    '''
+    if not len(a):
+        return 0.0
+    return float(numpy.max(numpy.abs(numpy.asarray(a, numpy.float64) - b)))
+
+
+def quantize_attribute(attribute, types, tolerance):
+    '''
+    Converts a Float32Array attribute OrderedDict to the first normalized
+    type, from the specified types, that can store the attribute array with
+    a maximum absolute error within tolerance.
+
+    The attribute is left unchanged when no type is accurate enough.
+
+    returns: True if the attribute was quantized
+    '''
+    array = attribute["array"]
+    for type in types:
+        quantized = quantize_normalized(array, type)
+        if max_error(array, dequantize_normalized(quantized, type)) \
+                <= tolerance:
+            attribute["type"] = type
+            attribute["array"] = quantized
+            attribute["normalized"] = True
+            return True
+    return False
+
+
+def quantize_position(attribute, tolerance):
+    '''
+    Converts a Float32Array position attribute OrderedDict to a normalized
+    Uint16Array, with a per-axis dequantization offset and scale:
+
+        position = offset + scale * normalized_position
+
+    The attribute is left unchanged if the maximum absolute error exceeds
+    tolerance.
+
+    returns: True if the attribute was quantized
+    '''
+    array = attribute["array"]
+    if not len(array):
+        return False
+    positions = numpy.asarray(array, dtype=numpy.float64).reshape(-1, 3)
+    offset = positions.min(axis=0)
+    scale = positions.max(axis=0) - offset
+
+    # avoid division by zero for flat axes
+    safe_scale = numpy.where(scale > 0, scale, 1.0)
+
+    max_value = (1 << POSITION_BITS) - 1
+    quantized = numpy.rint((positions - offset) / safe_scale * max_value)
+    quantized = quantized.astype(numpy.uint16)
+    dequantized = offset + quantized / max_value * scale
+    if max_error(positions, dequantized) > tolerance:
+        return False
+
+    attribute["type"] = "Uint16Array"
+    attribute["array"] = quantized.ravel()
+    attribute["normalized"] = True
+    dequantize = attribute["dequantize"] = OrderedDict()
+    dequantize["offset"] = offset.tolist()
+    dequantize["scale"] = scale.tolist()
+    return True
+
+
+def quantize_geometry(geometry,
+                      quantize_positions=False,
+                      tolerance=0.005,
+                      ):
+    '''
+    Converts the attributes of a BufferGeometry OrderedDict to narrower
+    typed array types:
+
+        index:    Uint16Array, when there are fewer than 65536 vertices
+        normal:   normalized Int8Array or Int16Array
+        uv:       normalized Uint16Array
+        color:    normalized Uint8Array or Uint16Array
+        position: normalized Uint16Array (optional)
+
+    Attributes stay Float32Array whenever the maximum absolute quantization
+    error exceeds tolerance.
+    '''
+
+    attributes = geometry["data"]["attributes"]
+
+    for name, types in ATTRIBUTE_TYPES.items():
+        if name in attributes:
+            quantize_attribute(attributes[name], types, tolerance)
+
+    if quantize_positions and "position" in attributes:
+        quantize_position(attributes["position"], tolerance)
+
+    index = attributes.get("index")
+    if index is not None and len(index["array"]):
+        if int(numpy.max(index["array"])) < 65536:
+            index["type"] = "Uint16Array"
+            index["array"] = numpy.asarray(index["array"],
+                                           dtype=numpy.uint16)
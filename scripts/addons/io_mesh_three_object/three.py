@@ -25,6 +25,7 @@ def create_object(type="Object",
 
 def create_object3d(object_name,
                     matrix=Matrix.Identity(4),
+                    object_uuid=None,
                     ):
     '''
     Creates an OrderedDict that represents a THREE.Object3D instance
@@ -33,7 +34,7 @@ def create_object3d(object_name,
 
     obj["name"] = object_name
     obj["type"] = "Object3D"
-    obj["uuid"] = uuid.uuid4()
+    obj["uuid"] = object_uuid or uuid.uuid4()
     obj["matrix"] = matrix
     obj["userData"] = {}
     obj["children"] = []
@@ -45,9 +46,10 @@ def create_mesh(mesh_name,
                 matrix=Matrix.Identity(4),
                 geometry_uuid=None,
                 material_uuid=None,
+                object_uuid=None,
                 ):
 
-    obj = create_object3d(mesh_name, matrix=matrix)
+    obj = create_object3d(mesh_name, matrix=matrix, object_uuid=object_uuid)
     obj["type"] = "Mesh"
     obj["geometry"] = geometry_uuid
     obj["material"] = material_uuid
@@ -55,15 +57,74 @@ def create_mesh(mesh_name,
     return obj
 
 
+def create_instanced_mesh(mesh_name,
+                          instance_matrices,
+                          matrix=Matrix.Identity(4),
+                          geometry_uuid=None,
+                          material_uuid=None,
+                          object_uuid=None,
+                          ):
+    '''
+    Creates an OrderedDict that represents a THREE.InstancedMesh instance
+
+    instance_matrices: float32 array with 16 matrix elements per instance
+    '''
+    obj = create_mesh(mesh_name,
+                      matrix=matrix,
+                      geometry_uuid=geometry_uuid,
+                      material_uuid=material_uuid,
+                      object_uuid=object_uuid)
+    obj["type"] = "InstancedMesh"
+    obj["count"] = len(instance_matrices)
+
+    instance_matrix = obj["instanceMatrix"] = OrderedDict()
+    instance_matrix["type"] = "Float32Array"
+    instance_matrix["itemSize"] = 16
+    instance_matrix["array"] = instance_matrices.ravel()
+
+    return obj
+
+
+def create_lod(lod_name,
+               matrix=Matrix.Identity(4),
+               object_uuid=None,
+               ):
+    '''
+    Creates an OrderedDict that represents a THREE.LOD instance
+    '''
+    obj = create_object3d(lod_name, matrix=matrix, object_uuid=object_uuid)
+    obj["type"] = "LOD"
+    obj["levels"] = []
+
+    return obj
+
+
+def add_lod_level(lod, level_object, distance=0.0):
+    '''
+    Adds a level object to a THREE.LOD OrderedDict. The object is added as
+    a child, and referenced by uuid from the LOD levels.
+    '''
+    level = OrderedDict()
+    level["object"] = level_object["uuid"]
+    level["distance"] = distance
+
+    lod["children"].append(level_object)
+    lod["levels"].append(level)
+
+
 def create_buffergeometry(geometry_name,
                           positions,
                           normals,
                           uvs,
                           colors,
                           indices,
+                          geometry_uuid=None,
                           ):
     '''
     Creates an OrderedDict that represents a THREE.BufferGeometry instance
+
+    Attribute arrays may be flat lists or flat numpy arrays, and are
+    omitted when None or empty.
     '''
 
     def create_attribute(array, type, itemSize):
@@ -77,29 +138,60 @@ def create_buffergeometry(geometry_name,
 
     obj["name"] = geometry_name
     obj["type"] = "BufferGeometry"
-    obj["uuid"] = uuid.uuid4()
+    obj["uuid"] = geometry_uuid or uuid.uuid4()
     data = obj["data"] = OrderedDict()
     attr = data["attributes"] = OrderedDict()
 
-    if positions:
+    if positions is not None and len(positions):
         attr["position"] = create_attribute(positions, "Float32Array", 3)
 
-    if normals:
+    if normals is not None and len(normals):
         attr["normal"] = create_attribute(normals, "Float32Array", 3)
 
-    if uvs:
+    if uvs is not None and len(uvs):
         attr["uv"] = create_attribute(uvs, "Float32Array", 2)
 
-    if colors:
+    if colors is not None and len(colors):
         attr["color"] = create_attribute(colors, "Float32Array", 3)
 
-    if indices:
+    if indices is not None and len(indices):
         attr["index"] = create_attribute(indices, "Uint32Array", 1)
 
     return obj
 
 
-def create_material(material, material_uuid=uuid.uuid4()):
+def add_morph_targets(geometry, morph_targets, in_userdata=False):
+    '''
+    Adds relative position morph targets to a BufferGeometry OrderedDict.
+
+    Targets are stored in data.morphAttributes.position, or in
+    userData.morphTargets when in_userdata is True. Targets sampled from
+    animation also store their frame number.
+
+    morph_targets: list of (name, frame, deltas) tuples
+    '''
+
+    targets = []
+    for name, frame, deltas in morph_targets:
+        target = OrderedDict()
+        target["name"] = name
+        if frame is not None:
+            target["frame"] = frame
+        target["type"] = "Float32Array"
+        target["itemSize"] = 3
+        target["array"] = deltas
+        targets.append(target)
+
+    if in_userdata:
+        user_data = geometry.setdefault("userData", OrderedDict())
+        user_data["morphTargets"] = targets
+    else:
+        data = geometry["data"]
+        data["morphAttributes"] = OrderedDict([("position", targets)])
+        data["morphTargetsRelative"] = True
+
+
+def create_material(material, material_uuid=None):
     '''
     '''
 
@@ -113,7 +205,7 @@ def create_material(material, material_uuid=uuid.uuid4()):
 
     obj["name"] = material.name
     obj["type"] = None
-    obj["uuid"] = material_uuid
+    obj["uuid"] = material_uuid or uuid.uuid4()
 
     obj["vertexColors"] = material.use_vertex_color_paint
     obj["transparent"] = bool(material.use_transparency)
@@ -149,3 +241,14 @@ def create_material(material, material_uuid=uuid.uuid4()):
             obj["shininess"] = int(material.specular_hardness / 10)
 
     return obj
+
+
+def material_fingerprint(material):
+    '''
+    Returns a hashable fingerprint of the material properties exported by
+    create_material. Materials with equal fingerprints export identical
+    Three.js materials, apart from their name and uuid.
+    '''
+    obj = create_material(material)
+    return tuple((key, value) for key, value in obj.items()
+                 if key not in ("name", "uuid"))
@@ -0,0 +1,122 @@
+import json
+import sys
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+# This module must not use bpy, since phase timings are also recorded in
+# worker processes.
+
+# export phases, in pipeline order
+PHASES = (
+    "fingerprint",
+    "modifiers",
+    "bmesh",
+    "triangulate",
+    "extract",
+    "split",
+    "morph",
+    "batch",
+    "index",
+    "bvh",
+    "bounds",
+    "quantize",
+    "encode",
+    "write",
+)
+
+
+class Timings(OrderedDict):
+    '''
+    Accumulated wall time, in seconds, of named export phases
+    '''
+
+    @contextmanager
+    def phase(self, name):
+        '''
+        Adds the time spent in the with statement body to a phase
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self[name] = self.get(name, 0.0) + time.perf_counter() - start
+
+    def update_totals(self, timings):
+        '''
+        Adds the phase times of another Timings
+        '''
+        for name, seconds in timings.items():
+            self[name] = self.get(name, 0.0) + seconds
+
+    def total(self):
+        return sum(self.values())
+
+
+def peak_memory(children=False):
+    '''
+    returns: peak resident memory in bytes of this process, or of its
+             terminated worker processes, or None if it is unknown
+    '''
+    if resource is None:
+        return None
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    peak = resource.getrusage(who).ru_maxrss
+    if sys.platform != "darwin":
+        # kilobytes on linux and bsd
+        peak *= 1024
+    return peak
+
+
+def sorted_phases(timings):
+    '''
+    returns: list of (phase, seconds) tuples in pipeline order
+    '''
+    order = {name: i for i, name in enumerate(PHASES)}
+    return sorted(timings.items(),
+                  key=lambda item: order.get(item[0], len(PHASES)))
+
+
+def print_summary(report, max_objects=10):
+    '''
+    Prints a summary table of an export report, as created by
+    object.create_report
+    '''
+
+    total_time = report["time"]
+    phases = report["phases"]
+
+    print("\n%-24s %10s %7s" % ("Phase", "Time (s)", "%"))
+    for name, seconds in sorted_phases(phases):
+        print("%-24s %10.3f %6.1f%%" %
+              (name, seconds, 100 * seconds / (total_time or 1)))
+    print("%-24s %10.3f" % ("Total (wall)", total_time))
+
+    objects = sorted(report["objects"],
+                     key=lambda o: o["time"],
+                     reverse=True)[:max_objects]
+    if objects:
+        print("\n%-32s %10s %10s %10s" %
+              ("Slowest Objects", "Time (s)", "Vertices", "Faces"))
+        for o in objects:
+            print("%-32s %10.3f %10d %10d" %
+                  (o["name"][:32], o["time"], o["vertices"], o["faces"]))
+
+    for key, label in (("peak_memory", "Peak memory"),
+                       ("peak_worker_memory", "Peak worker memory")):
+        if report.get(key):
+            print("%s: %.1f MB" % (label, report[key] / (1024 * 1024)))
+
+
+def write_report(filepath, report):
+    '''
+    Writes an export report to a JSON stats file
+    '''
+    with open(filepath, "w", encoding="utf8", newline="\n") as file:
+        json.dump(report, file, indent=4)
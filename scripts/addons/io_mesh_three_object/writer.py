@@ -0,0 +1,84 @@
+import os
+from . import json
+
+
+def encode_geometry(geometry, indent=4,
+                    float_precision=json.JSON_FLOAT_PRECISION):
+    '''
+    Encodes a BufferGeometry OrderedDict as JSON, formatted to be written
+    with StreamWriter.write_encoded
+    '''
+    return "".join(json.iterencode(geometry, indent, 1, float_precision))
+
+
+class StreamWriter:
+    '''
+    Writes a Three.js Object JSON file incrementally.
+
+    Geometries are encoded and written to the file as soon as they are
+    saved, so only one geometry is held in memory at a time. The other top
+    level values (metadata, object, materials) are written by finish().
+
+    The file is written to a temporary file next to filepath, which only
+    replaces filepath once finish() completes, so a failed export never
+    leaves a truncated file in place of a previous export.
+    '''
+
+    def __init__(self, filepath, indent=4,
+                 float_precision=json.JSON_FLOAT_PRECISION):
+        self.filepath = filepath
+        self.temp_filepath = filepath + ".tmp"
+        self.indent = indent
+        self.float_precision = float_precision
+        self.num_geometries = 0
+        self.file = open(self.temp_filepath, "w", encoding="utf8",
+                         newline="\n")
+        self.file.write("{\n%s\"geometries\": [" % (" " * indent))
+
+    def _write_chunks(self, o, level):
+        write = self.file.write
+        for chunk in json.iterencode(o, self.indent, level,
+                                     self.float_precision):
+            write(chunk)
+
+    def write_geometry(self, geometry):
+        '''
+        Encodes a BufferGeometry OrderedDict and writes it to the file
+        '''
+        if self.num_geometries:
+            self.file.write(",")
+        self._write_chunks(geometry, 1)
+        self.num_geometries += 1
+
+    def write_encoded(self, text):
+        '''
+        Writes a BufferGeometry that was encoded with encode_geometry
+        '''
+        if self.num_geometries:
+            self.file.write(",")
+        self.file.write(text)
+        self.num_geometries += 1
+
+    def finish(self, output):
+        '''
+        Writes the remaining top level values of the output OrderedDict,
+        closes the file, and moves it to filepath. Any "geometries" value
+        is ignored.
+        '''
+        self.file.write("]")
+        for key, value in output.items():
+            if key == "geometries" or value is None:
+                continue
+            self.file.write(",\n%s\"%s\": " % (" " * self.indent, key))
+            self._write_chunks(value, 1)
+        self.file.write("\n}")
+        self.file.close()
+        os.replace(self.temp_filepath, self.filepath)
+
+    def close(self):
+        '''
+        Closes and deletes an unfinished file. Does nothing after finish().
+        '''
+        self.file.close()
+        if os.path.exists(self.temp_filepath):
+            os.remove(self.temp_filepath)
@@ -0,0 +1,339 @@
+'''
+Command line driver for the Three.js Object exporter.
+
+Export a single .blend file (runs inside Blender):
+
+    blender -b scene.blend -P export_cli.py -- -o scene.json \
+        [--preset "Static Mesh"] [--option name=value ...] \
+        [--summary summary.json]
+
+Export many .blend files listed in a manifest, with N Blender worker
+processes (runs with any Python 3, or inside Blender):
+
+    python export_cli.py --manifest manifest.txt --jobs 8 \
+        [--blender /path/to/blender] [--output-dir out] \
+        [--preset "Static Mesh"] [--option name=value ...] \
+        [--summary summary.json]
+
+Each manifest line is a .blend filepath, optionally followed by a tab and
+an output filepath. Empty lines and lines starting with # are ignored.
+
+Options are the ExportThreeObject operator properties (global_scale,
+selected_only, binary_attributes ...), and presets are the operator presets
+of the add-on. --option values override preset values.
+'''
+
+import argparse
+import ast
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+ADDON_MODULE = "io_mesh_three_object"
+
+PRESET_SUBDIR = os.path.join("operator", "export_three_object.json")
+
+# extensions of the sidecar files that an export writes next to the JSON
+# file, with binary.sidecar_filepath: binary attributes, BVH and stats.
+# The .cache directory holds reusable build results, not export output.
+SIDECAR_EXTENSIONS = (".bin", ".bvh", ".stats.json")
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="export_cli.py",
+        description="Export Three.js Object Format JSON files")
+    parser.add_argument("-o", "--output",
+                        help="output .json filepath (single file mode)")
+    parser.add_argument("--manifest",
+                        help="file listing .blend files to export")
+    parser.add_argument("--output-dir",
+                        help="output folder for manifest files without an "
+                             "output filepath (default: next to each .blend)")
+    parser.add_argument("--blender", default=None,
+                        help="Blender executable used for manifest workers")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                        help="number of Blender worker processes")
+    parser.add_argument("--preset",
+                        help="operator preset name, or preset filepath")
+    parser.add_argument("--option", action="append", default=[],
+                        metavar="NAME=VALUE",
+                        help="operator option, may be repeated")
+    parser.add_argument("--summary",
+                        help="write a JSON timing and size summary")
+    return parser.parse_args(argv)
+
+
+def script_args():
+    '''
+    Returns the command line arguments meant for this script. Inside
+    Blender, these are the arguments after "--".
+    '''
+    if "--" in sys.argv:
+        return sys.argv[sys.argv.index("--") + 1:]
+    if in_blender():
+        return []
+    return sys.argv[1:]
+
+
+def in_blender():
+    try:
+        import bpy
+    except ImportError:
+        return False
+    return True
+
+
+def output_filepaths(filepath):
+    '''
+    Returns the existing files written by an export to filepath: the JSON
+    file and its sidecar files
+    '''
+    base = os.path.splitext(filepath)[0]
+    filepaths = [filepath] + [base + extension
+                              for extension in SIDECAR_EXTENSIONS]
+    return [f for f in filepaths if os.path.isfile(f)]
+
+
+def print_summary(results):
+    '''
+    Prints a table of per-file export results
+    '''
+    print("\n%-40s %8s %10s %12s" %
+          ("File", "Status", "Time (s)", "Size (KB)"))
+    for r in results:
+        print("%-40s %8s %10.2f %12.1f" % (os.path.basename(r["blend"])[-40:],
+                                           r["status"],
+                                           r["time"],
+                                           r["size"] / 1024))
+    print("%-40s %8s %10.2f %12.1f" % ("Total",
+                                       "",
+                                       sum(r["time"] for r in results),
+                                       sum(r["size"] for r in results) / 1024))
+
+
+def write_summary(filepath, results):
+    with open(filepath, "w", encoding="utf8", newline="\n") as file:
+        json.dump(results, file, indent=4)
+
+
+# single file mode (inside Blender)
+
+def read_preset(preset):
+    '''
+    Reads the option values set by an operator preset file.
+
+    Presets are python files that assign values to the active operator
+    (op.name = value). The values are read without executing the file.
+    '''
+    import bpy
+
+    filepath = preset
+    if not os.path.isfile(filepath):
+        filepath = bpy.utils.preset_find(preset, PRESET_SUBDIR)
+    if not filepath:
+        raise FileNotFoundError("Preset not found: %s" % (preset))
+
+    with open(filepath, encoding="utf8") as file:
+        tree = ast.parse(file.read(), filepath)
+
+    options = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Assign) and len(node.targets) == 1:
+            target = node.targets[0]
+            if isinstance(target, ast.Attribute) and \
+                    isinstance(target.value, ast.Name) and \
+                    target.value.id == "op":
+                options[target.attr] = ast.literal_eval(node.value)
+    return options
+
+
+def parse_options(option_args):
+    '''
+    Converts NAME=VALUE arguments to operator option values, using the
+    type of each operator property.
+    '''
+    import bpy
+
+    properties = bpy.ops.export_three_object.json.get_rna().bl_rna.properties
+
+    options = {}
+    for arg in option_args:
+        name, sep, value = arg.partition("=")
+        if not sep or name not in properties:
+            raise ValueError("Unknown option: %s" % (arg))
+        prop_type = properties[name].type
+        if prop_type == "BOOLEAN":
+            value = value.lower() in ("1", "true", "yes", "on")
+        elif prop_type == "INT":
+            value = int(value)
+        elif prop_type == "FLOAT":
+            value = float(value)
+        options[name] = value
+    return options
+
+
+def export_file(args):
+    '''
+    Exports the open .blend file
+    '''
+    import bpy
+    import addon_utils
+
+    addon_utils.enable(ADDON_MODULE, default_set=True)
+
+    blend_filepath = bpy.data.filepath
+    filepath = args.output
+    if not filepath:
+        filepath = os.path.splitext(blend_filepath)[0] + ".json"
+    filepath = os.path.abspath(filepath)
+
+    options = {}
+    if args.preset:
+        options.update(read_preset(args.preset))
+    options.update(parse_options(args.option))
+    options.pop("filepath", None)
+
+    # the operator needs an active object
+    scene = bpy.context.scene
+    if scene.objects.active is None and len(scene.objects):
+        scene.objects.active = scene.objects[0]
+
+    start = time.time()
+    status = "FAILED"
+    try:
+        result = bpy.ops.export_three_object.json("EXEC_DEFAULT",
+                                                  filepath=filepath,
+                                                  **options)
+        status = "FINISHED" if "FINISHED" in result else "CANCELLED"
+    finally:
+        summary = {
+            "blend": blend_filepath,
+            "output": filepath,
+            "status": status,
+            "time": time.time() - start,
+            "size": sum(os.path.getsize(f)
+                        for f in output_filepaths(filepath)),
+        }
+        if args.summary:
+            write_summary(args.summary, summary)
+        print_summary([summary])
+
+    return summary
+
+
+# manifest mode
+
+def read_manifest(filepath, output_dir=None):
+    '''
+    returns: list of (blend_filepath, output_filepath) tuples
+    '''
+    base_dir = os.path.dirname(os.path.abspath(filepath))
+    result = []
+    with open(filepath, encoding="utf8") as file:
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            blend, sep, output = line.partition("\t")
+            blend = os.path.join(base_dir, blend.strip())
+            output = output.strip()
+            if output:
+                output = os.path.join(base_dir, output)
+            else:
+                name = os.path.splitext(os.path.basename(blend))[0]
+                folder = output_dir or os.path.dirname(blend)
+                output = os.path.join(folder, name + ".json")
+            result.append((blend, os.path.abspath(output)))
+    return result
+
+
+def export_manifest(args):
+    '''
+    Exports every .blend file in the manifest, each in its own Blender
+    worker process, running at most args.jobs workers at once.
+    '''
+
+    blender = args.blender
+    if not blender:
+        if in_blender():
+            import bpy
+            blender = bpy.app.binary_path
+        else:
+            blender = "blender"
+
+    files = read_manifest(args.manifest, args.output_dir)
+    temp_dir = tempfile.mkdtemp(prefix="three_export_")
+
+    def run(number, blend, output):
+        summary_filepath = os.path.join(temp_dir, "%d.json" % (number))
+        command = [blender, "-b", blend, "-P", os.path.abspath(__file__),
+                   "--", "-o", output, "--summary", summary_filepath]
+        if args.preset:
+            command += ["--preset", args.preset]
+        for option in args.option:
+            command += ["--option", option]
+
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        start = time.time()
+        process = subprocess.run(command,
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.STDOUT)
+        try:
+            with open(summary_filepath, encoding="utf8") as file:
+                summary = json.load(file)
+        except (OSError, ValueError):
+            summary = {
+                "blend": blend,
+                "output": output,
+                "status": "FAILED",
+                "time": time.time() - start,
+                "size": 0,
+            }
+        summary["returncode"] = process.returncode
+        if summary["status"] != "FINISHED" or process.returncode:
+            summary["log"] = process.stdout.decode("utf8", "replace")
+        print("%s: %s (%.2fs)" % (blend, summary["status"], summary["time"]))
+        return summary
+
+    start = time.time()
+    with ThreadPoolExecutor(max(1, args.jobs)) as executor:
+        futures = [executor.submit(run, number, blend, output)
+                   for number, (blend, output) in enumerate(files)]
+        results = [future.result() for future in futures]
+
+    for filename in os.listdir(temp_dir):
+        os.remove(os.path.join(temp_dir, filename))
+    os.rmdir(temp_dir)
+
+    print_summary(results)
+    print("\n%d files exported in %.2fs with %d jobs" %
+          (len(results), time.time() - start, args.jobs))
+
+    if args.summary:
+        write_summary(args.summary, results)
+
+    return results
+
+
+def main():
+    args = parse_args(script_args())
+    if args.manifest:
+        results = export_manifest(args)
+        failed = [r for r in results if r["status"] != "FINISHED"]
+    else:
+        if not in_blender():
+            sys.exit("Single file export must run inside Blender, "
+                     "or use --manifest")
+        failed = export_file(args)["status"] != "FINISHED"
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()